@@ -8,6 +8,7 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
 import argparse
+import functools
 import logging
 import time
 
@@ -456,9 +457,10 @@ class commsCollBench(paramCommsBench):
             for _ in range(self.collectiveArgs.numCollPerIter):
                 self.collectiveArgs.group = self.backendFuncs.get_next_group()
                 comm_fn(self.collectiveArgs)
-                # post another collecitve if on comms pair mode, otherwise it's noop
+                # post another collecitve if on comms pair mode
                 self.collectiveArgs.group = self.backendFuncs.get_next_group()
-                comm_fn_pair(self.collectiveArgs, pair=enable_comms_pair)
+                if enable_comms_pair:
+                    comm_fn_pair(self.collectiveArgs)
 
             if enable_compute:
                 with paramStreamGuard(
@@ -1308,16 +1310,20 @@ class commsCollBench(paramCommsBench):
             # Setup the arguments.
             self.collectiveArgs.dataSize = curSize
             self.collectiveArgs.numElements = numElements
-            self.collectiveArgs.waitObj = []
+            self.collectiveArgs.waitObj.clear()
             results["numElements"] = numElements
 
             if (
                 commsParams.pair and commsParams.mode != "compute"
             ):  # comms-pair specific initializations if not in compute-only mode:
-                # set corresponding function pointers
+                # set corresponding function pointers, pair=True is bound once instead of passed per call
                 collectiveFunc_pair = backendFuncs.collectiveFunc[
                     commsParams.collective_pair
                 ]
+                if collectiveFunc_pair != backendFuncs.noop:
+                    collectiveFunc_pair = functools.partial(
+                        collectiveFunc_pair, pair=True
+                    )
                 # TODO: allow user to set specific size
                 # Setup the arguments.
                 self.collectiveArgs.dataSize_pair = curSize
@@ -9,11 +9,17 @@ from __future__ import absolute_import, division, print_function, unicode_litera
 
 import argparse
 import copy
+import importlib
 import json
 import logging
+import os
+import pathlib
 import time
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from os import path
-from typing import Dict, List, Set
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
 import comms_utils
 import numpy as np
@@ -28,32 +34,284 @@ from comms_utils import (
     paramToCommName,
 )
 
+try:
+    import orjson
+
+    has_orjson = True
+except ImportError:
+    has_orjson = False
+
 logger = logging.getLogger(__name__)
 
+# supported network stacks -> (module, class) of their backend, the module is only imported when the stack is used
+REPLAY_BACKENDS = {
+    "pytorch-dist": ("pytorch_dist_backend", "PyTorchDistBackend"),
+    "pytorch-xla-tpu": ("pytorch_tpu_backend", "PyTorchTPUBackend"),
+}
+
 # sleep for 20ms to wait for next collective
 LOOP_TIMER_S = 0.02
+LOOP_TIMER_NS = int(LOOP_TIMER_S * 1e9)
+
+# collectives with a single input and output tensor whose buffers can be pooled across entries, see prepComms()
+POOLED_INPLACE_COLLS = ("all_reduce", "reduce", "broadcast")
+POOLED_OUTOFPLACE_COLLS = ("all_to_allv", "pt2pt")
+
+
+def _stats(values) -> (float, float, float, float, float, float):
+    """
+    Summary statistics of a series of sizes or latencies.
+
+    Args:
+        values: Array-like of numbers, must not be empty.
+    Returns:
+        (total, max, min, average, p50, p95): p50 and p95 are computed with a single quantile pass.
+    """
+    a = np.asarray(values)
+    (p50, p95) = np.quantile(a, [0.5, 0.95])
+    return (a.sum(), a.max(), a.min(), a.mean(), p50, p95)
+
+
+def _groupBounds(ids: np.ndarray, numGroups: int) -> (np.ndarray, np.ndarray):
+    """
+    Group the entries by id with a stable sort.
+
+    Args:
+        ids: Group id of each entry, in [0, numGroups).
+        numGroups: Number of groups.
+    Returns:
+        (order, bounds): the entries of group i are order[bounds[i] : bounds[i + 1]].
+    """
+    order = np.argsort(ids, kind="stable")
+    bounds = np.searchsorted(ids[order], np.arange(numGroups + 1))
+    return (order, bounds)
+
+
+def _groupStats(sortedValues: np.ndarray, bounds: np.ndarray) -> List[np.ndarray]:
+    """
+    Per-group summary statistics of values sorted by group, see _groupBounds().
 
+    Args:
+        sortedValues: Values sorted by group, every group must not be empty.
+        bounds: Start offsets of the groups followed by the total number of values.
+    Returns:
+        [total, max, min, average, p50, p95], one array of per-group values each.
+    """
+    starts = bounds[:-1]
+    total = np.add.reduceat(sortedValues, starts)
+    quantiles = np.array(
+        [
+            np.quantile(sortedValues[begin:end], [0.5, 0.95])
+            for (begin, end) in zip(bounds[:-1], bounds[1:])
+        ]
+    ).reshape(-1, 2)
+    return [
+        total,
+        np.maximum.reduceat(sortedValues, starts),
+        np.minimum.reduceat(sortedValues, starts),
+        total / np.diff(bounds),
+        quantiles[:, 0],
+        quantiles[:, 1],
+    ]
+
+
+@dataclass
+class PreparedComm:
+    """
+    Replay info of a trace entry that only depends on the trace, precomputed by initDispatchPlan().
+
+    Public Attributes:
+        cnt: Index of the entry in the trace.
+        curComm: The trace entry.
+        collName: Normalized name of the collective.
+        groupRank: Rank of the local process in the PG of the entry.
+        groupDesc: Description of the PG for logging.
+        curBlocks: Markers that the entry is a part of.
+        curBlockStack: Markers joined for logging and the replayed record.
+        baseRecord: Replayed record without the timings, copied per replayed comm by getTraceWithPerf(). None if it has to be built
+                    after prepComms(), i.e., sizes may be changed by --auto-shrink.
+    """
+
+    __slots__ = (
+        "cnt",
+        "curComm",
+        "collName",
+        "groupRank",
+        "groupDesc",
+        "curBlocks",
+        "curBlockStack",
+        "baseRecord",
+    )
+    cnt: int
+    curComm: commsArgs
+    collName: str
+    groupRank: int
+    groupDesc: str
+    curBlocks: tuple
+    curBlockStack: str
+    baseRecord: Optional[Dict]
+
+
+class _AllColls:
+    """
+    Allow list that contains every collective, used for `--allow-ops all` until it is resolved against the backend.
+    """
 
-def writeCommDetails(commsTracePerf: List, rank: int, folder: str = "./") -> None:
+    def __contains__(self, collName: str) -> bool:
+        return True
+
+    def __repr__(self) -> str:
+        return "all"
+
+
+_ALL = _AllColls()
+
+
+def parseAllowList(allowOps: str):
+    """
+    Parse the comma separated `--allow-ops` into a set of normalized collective names.
+
+    Args:
+        allowOps: Comma separated collectives, or one of "all", "default", "*" for all collectives.
+    Returns:
+        _ALL for all collectives, frozenset of the normalized names otherwise.
+    """
+    if allowOps in ("all", "default", "*"):
+        return _ALL
+    return frozenset(paramToCommName(op.strip()) for op in allowOps.split(","))
+
+
+def _newCommsBlock() -> Dict[str, List]:
+    """
+    Columns of the comms recorded for a marker block on dry run, one entry per comm in each column.
+    """
+    return {"comms": [], "in_msg_size": [], "out_msg_size": []}
+
+
+def _joinBlockStack(curBlocks: Tuple[str, ...]) -> str:
+    """
+    Join the markers of a comm for logging, profiling ranges and the replayed record.
+
+    Args:
+        curBlocks: Markers that the comm is a part of.
+    Returns:
+        str: The markers separated by spaces, or "Unamed/Unknown" if there is none.
+    """
+    return " ".join(curBlocks) if len(curBlocks) > 0 else "Unamed/Unknown"
+
+
+def _recordStream(tensors: Union[torch.Tensor, List[torch.Tensor]], stream) -> None:
+    """
+    Mark CUDA tensors allocated on another stream as used by stream, so the caching allocator
+    does not reuse their memory before the work queued on stream is done.
+
+    Args:
+        tensors: Tensor or list of tensors, tensors not on CUDA devices are skipped.
+        stream: CUDA stream that uses the tensors.
+    Returns:
+        None
+    """
+    for tensor in tensors if isinstance(tensors, list) else (tensors,):
+        if isinstance(tensor, torch.Tensor) and tensor.is_cuda:
+            tensor.record_stream(stream)
+
+
+def _appendPrealloc(
+    arrays: Dict[str, np.ndarray], counts: Dict[str, int], key: str, value
+) -> None:
+    """
+    Append value to the preallocated arrays[key] holding counts[key] values, the array is grown if full.
+
+    Args:
+        arrays: Preallocated arrays.
+        counts: Number of values appended to each array.
+        key: Key of the array to append to.
+        value: Value to append.
+    Returns:
+        None
+    """
+    arr = arrays[key]
+    idx = counts[key]
+    if idx == len(arr):
+        # more values than planned, e.g., replayTrace() called more than num_replays times
+        arr = arrays[key] = np.concatenate((arr, np.empty(max(len(arr), 1), arr.dtype)))
+    arr[idx] = value
+    counts[key] = idx + 1
+
+
+def _loadJson(raw) -> Union[Dict, List]:
+    """
+    Parse JSON from a file object, str or bytes, using orjson if available.
+
+    Args:
+        raw: File object opened in text or binary mode, or the JSON content itself.
+    Returns:
+        Union[Dict, List]: Parsed JSON.
+    """
+    if hasattr(raw, "read"):
+        raw = raw.read()
+    if has_orjson:
+        return orjson.loads(raw)
+    # json.loads also accepts UTF-8 encoded bytes
+    return json.loads(raw)
+
+
+# timings of each replayed comm, see commsTraceReplayBench.perfCols
+PERF_TIME_COLS = ("quant_us", "dequant_us", "latency_us", "global_latency_us")
+
+
+def _newPerfCols(capacity: int) -> Dict[str, np.ndarray]:
+    """
+    Columns of the replayed comms, one row per replayed comm.
+
+    Args:
+        capacity: Number of rows to preallocate.
+    Returns:
+        Dict[str, np.ndarray]: The timings in PERF_TIME_COLS and prepared_idx, the index of the comm in the prepared trace.
+    """
+    perfCols = {col: np.empty(capacity, dtype=np.float64) for col in PERF_TIME_COLS}
+    perfCols["prepared_idx"] = np.empty(capacity, dtype=np.int32)
+    return perfCols
+
+
+def writeCommDetails(
+    commsTracePerf: Iterable[Dict],
+    rank: int,
+    folder: Union[str, pathlib.Path, None] = "./",
+    isRemote: Optional[bool] = None,
+    jsonLines: bool = False,
+) -> None:
     """
     Writes the replayed comm details of the current rank.
 
     Args:
-        commsTracePerf: List that contains the metrics of each replayed collective in the current rank.
+        commsTracePerf: Records that contain the metrics of each replayed collective in the current rank.
         rank: The current rank that the comm details will be written for.
         folder: Directory path to where the comm details for all ranks will be written.
-                                If none, no output will be written.
+                                If none or empty, no output will be written.
+        isRemote: Whether folder is a remote store, inferred from "://" in folder if not provided.
+        jsonLines: Write a local file with one JSON record per line (.jsonl) while iterating commsTracePerf,
+                   instead of a JSON list (.json) that needs all the records at once. Ignored for remote stores.
     Returns:
         None
     """
-    if len(folder) == 0:
+    if folder is None or (isinstance(folder, str) and len(folder) == 0):
         # skip output if the path is explicitly set to ""
         return
-    comms_file = folder + f"/replayedCommsPerf.rank{rank}.json"
+    if isRemote is None:
+        # assume that "://" in directory path means remote store
+        isRemote = "://" in str(folder)
+    # the remote store takes the JSON list
+    jsonLines = jsonLines and not isRemote
+    if not jsonLines and not isinstance(commsTracePerf, list):
+        commsTracePerf = list(commsTracePerf)
+    fileName = f"replayedCommsPerf.rank{rank}.json" + ("l" if jsonLines else "")
+    # keep remote urls as str since pathlib collapses the "//" of the protocol prefix
+    comms_file = f"{folder}/{fileName}" if isRemote else pathlib.Path(folder) / fileName
     logger.info(f"[Rank {rank:3}] Writing comms details to {comms_file}")
 
     saveToLocal = True
-    if "://" in comms_file:  # assume that "://" in directory path means remote store
+    if isRemote:
         saveToLocal = False
         try:
             from internals import writeRemoteTrace as writeFbRemoteTrace
@@ -65,16 +323,33 @@ def writeCommDetails(commsTracePerf: List, rank: int, folder: str = "./") -> Non
 
     if saveToLocal:
         try:
-            import subprocess
-
-            subprocess.check_output(
-                ["mkdir", "-p", str(folder)], universal_newlines=True
-            )
-        except Exception as err:
+            os.makedirs(folder, exist_ok=True)
+        except OSError as err:
             logger.error("\t Error: %s while creating directory: %s " % (err, folder))
             pass
-        with open(comms_file, "w") as write_file:
-            json.dump(commsTracePerf, write_file, indent=2)
+        if jsonLines:
+            # stream the records so only one of them is serialized at a time
+            with open(comms_file, "wb", buffering=32 << 20) as write_file:
+                for recordComm in commsTracePerf:
+                    if has_orjson:
+                        write_file.write(
+                            orjson.dumps(recordComm, option=orjson.OPT_SERIALIZE_NUMPY)
+                        )
+                    else:
+                        write_file.write(json.dumps(recordComm).encode())
+                    write_file.write(b"\n")
+        elif has_orjson:
+            # orjson serializes in C, write the result through a large buffer to reduce write syscalls
+            with open(comms_file, "wb", buffering=32 << 20) as write_file:
+                write_file.write(
+                    orjson.dumps(
+                        commsTracePerf,
+                        option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+                    )
+                )
+        else:
+            with open(comms_file, "w") as write_file:
+                json.dump(commsTracePerf, write_file, indent=2)
 
 
 class commsTraceReplayBench(paramCommsBench):
@@ -87,7 +362,7 @@ class commsTraceReplayBench(paramCommsBench):
     """
 
     def __init__(self):
-        super().__init__(supportedNwstacks=["pytorch-dist", "pytorch-xla-tpu"])
+        super().__init__(supportedNwstacks=list(REPLAY_BACKENDS))
         self.comms_trace = {}
         self.trace_file = ""
         self.use_remote_trace = False
@@ -97,25 +372,56 @@ class commsTraceReplayBench(paramCommsBench):
         self.num_msg = 0
         self.is_blocking = True
         self.do_warm_up = True
-        self.allowList = ""
+        # number of replays of the trace for warm-up, see benchTime()
+        self.warmup_replays = 1
+        self.legacy_json = False
+        self.allowList = frozenset()
         self.out_path = ""
+        # output location resolved once from out_path, see checkArgs()
+        self._out_is_remote = False
+        self._out_dir: Union[str, pathlib.Path, None] = None
         self.colls_per_batch = -1
         self.use_timestamp = False
         self.num_replays = 1
-
-        self.collInMsgSizes: Dict[str, List] = {}
-        self.collInUniMsgSizes: Dict[str, Set] = {}
-        self.collOutMsgSizes: Dict[str, List] = {}
-        self.collOutUniMsgSizes: Dict[str, Set] = {}
+        self.inter_replay_barrier = False
+        self.event_timing = False
+
+        self.collInMsgSizes: Dict[str, np.ndarray] = {}
+        self.collInUniMsgSizes: Dict[str, np.ndarray] = {}
+        self.collOutMsgSizes: Dict[str, np.ndarray] = {}
+        self.collOutUniMsgSizes: Dict[str, np.ndarray] = {}
+        # flat in/out sizes of the comms that have sizes, coll_id indexes the collectives of collInMsgSizes
+        self.sizes_in = np.empty(0, dtype=np.int64)
+        self.sizes_out = np.empty(0, dtype=np.int64)
+        self.coll_id = np.empty(0, dtype=np.int32)
 
         self.batchLat = []
-        self.collLat: Dict[str, List] = {}
-
-        self.comms_blocks: Dict[str, List] = {}
-        self.traceWithPerf = []
+        # replayed latencies of each collective, views of the preallocated collLat_np
+        self.collLat: Dict[str, np.ndarray] = {}
+        self.collLat_np: Dict[str, np.ndarray] = {}
+        self._lat_idx: Dict[str, int] = {}
+
+        # columns of the comms in each block on dry run, see _newCommsBlock()
+        self.comms_blocks: Dict[str, Dict[str, List]] = {}
+        # timings of the replayed comms stored as columns, the first numPerfRecords rows are filled,
+        # see getTraceWithPerf() to build the replayed records
+        self.perfCols: Dict[str, np.ndarray] = _newPerfCols(0)
+        self.numPerfRecords = 0
+        # replayed records built after prepComms() for --auto-shrink, by row of perfCols
+        self._shrinkRecords: Dict[int, Dict] = {}
+        # rows of perfCols of the comms replayed in each block, preallocated like collLat_np
+        self.blockRecordIdx: Dict[str, np.ndarray] = {}
+        self._block_idx: Dict[str, int] = {}
         self.blockStack = []
+        # execution graph node id -> index of its comm in comms_trace, built by initTraceStat()
+        self._eg_id_index: Dict[int, int] = {}
+        # whether this is global rank 0, set once per benchTime()
+        self._is_rank0 = False
 
         self.rebalance_policy = ""
+        # buffer for the all_reduce of rebalanceSplit(), allocated on first use
+        self._scratch_i32 = None
+        self._scratch_device = None
 
         # for blocking collectives this is the sum of all the collective latencies
         # for nonblocking collectives this is the sum of how long each collective took to be sent to the device
@@ -125,6 +431,32 @@ class commsTraceReplayBench(paramCommsBench):
 
         self.eg_to_tensors = {}
 
+        # free tensors keyed by (number of elements, dtype, device), and the pooled tensors used by the current entry
+        self._tensorPool: Dict[
+            Tuple[int, torch.dtype, str], List[torch.Tensor]
+        ] = defaultdict(list)
+        self._pooledInUse: List[Tuple[Tuple[int, torch.dtype, str], torch.Tensor]] = []
+        # tensors of each trace entry kept across replays, see replayTrace()
+        self._tensor_cache: Dict[int, Tuple[torch.Tensor, torch.Tensor]] = {}
+
+        # (groupRank, groupDesc) per PG, None stands for the default group
+        self._pgInfoCache: Dict[Optional[int], Tuple[int, str]] = {}
+
+        # per-entry dispatch info of the trace, built by initDispatchPlan()
+        self.dispatchCollNames: List[str] = []
+        self.dispatchCodes = np.empty(0, dtype=np.int32)
+        self.dispatchGroupRanks = np.empty(0, dtype=np.int32)
+        self.dispatchGroupDescs: List[str] = []
+        self.dispatchBlocks: List[tuple] = []
+        # marker stack -> markers joined by _joinBlockStack(), kept across initDispatchPlan() and replaySingle() calls
+        self._block_stack_cache: Dict[tuple, str] = {}
+        self.dispatchMask = np.zeros(0, dtype=bool)
+        self._prepared_trace: List[PreparedComm] = []
+        # (start, end) CUDA events of each prepared entry for --event-timing, reused by each replay
+        self._eventPool: List[Tuple[torch.cuda.Event, torch.cuda.Event]] = []
+        # side stream to prepare the tensors of the next entry in nonblocking replays on CUDA devices
+        self._prep_stream = None
+
     def readArgs(self, parser: argparse.ArgumentParser) -> None:
         """
         Reads command line args to set runtime parameters for replay.
@@ -172,6 +504,18 @@ class commsTraceReplayBench(paramCommsBench):
             default=self.do_warm_up,
             help="Toggle to disable performing extra replaying for warm-up",
         )
+        parser.add_argument(
+            "--warmup-replays",
+            type=int,
+            default=self.warmup_replays,
+            help="Number of times to replay the given trace for warm-up, their timings are discarded. With --rebalance-policy or --auto-shrink a single warm-up pass on copies of the trace entries is used instead.",
+        )
+        parser.add_argument(
+            "--legacy-json",
+            action="store_true",
+            default=self.legacy_json,
+            help="Write the replayed comm details of each rank as a single JSON list (.json) instead of one JSON record per line (.jsonl)",
+        )
         parser.add_argument(
             "--allow-ops",
             "--allow-list",
@@ -211,6 +555,18 @@ class commsTraceReplayBench(paramCommsBench):
             default=self.num_replays,
             help="Number of times to replay the given trace, used to get more accurate replay for small traces.",
         )
+        parser.add_argument(
+            "--inter-replay-barrier",
+            action="store_true",
+            default=self.inter_replay_barrier,
+            help="Toggle to sync all ranks after each replay of the trace, otherwise only sync once after all replays. The barriers are counted in the total trace latency.",
+        )
+        parser.add_argument(
+            "--event-timing",
+            action="store_true",
+            default=self.event_timing,
+            help="Toggle to time collectives with CUDA events on the current stream instead of host timers, only for CUDA devices. The events are read once at the end of each replay.",
+        )
         args, _ = parser.parse_known_args()
         return args
 
@@ -234,6 +590,15 @@ class commsTraceReplayBench(paramCommsBench):
             )
             comms_utils.gracefulExit()
 
+        self._out_is_remote = "://" in args.output_path
+        if len(args.output_path) == 0:
+            # skip output
+            self._out_dir = None
+        elif self._out_is_remote:
+            self._out_dir = args.output_path
+        else:
+            self._out_dir = pathlib.Path(args.output_path)
+
     def reportBenchTime(self):
         """
         Prints replay benchmarks for current rank. This should only be called after setBench() and benchTime()
@@ -252,55 +617,56 @@ class commsTraceReplayBench(paramCommsBench):
             f"\n+++++ {len(self.comms_trace)} msgs recorded in {self.trace_file} +++++\n"
         )
 
+        if not self.is_dry_run:
+            recordLats = self.perfCols["latency_us"][: self.numPerfRecords]
         for curBlock, blockComms in self.comms_blocks.items():
-            lat_list = []
+            numComms = len(blockComms["comms"])
+            totalLat = 0.0
             if not self.is_dry_run:
-                lat_list = [comm["latency_us"] for comm in blockComms]
-            Lats = np.array(lat_list)
+                numComms = self._block_idx.get(curBlock, 0)
+                if numComms > 0:
+                    totalLat = recordLats[
+                        self.blockRecordIdx[curBlock][:numComms]
+                    ].sum()
 
             logger.info(
-                f"+ {len(blockComms)} comms in block {curBlock}: {Lats.sum():.2f} us in total"
+                f"+ {numComms} comms in block {curBlock}: {totalLat:.2f} us in total"
             )
 
         logger.info("\n{} Message size Statistcs {}".format("=" * 20, "=" * 20))
 
-        for (name, collMsgs) in self.collInMsgSizes.items():
-            # input tensor
-            msgSizes = np.array(collMsgs)
+        # only build the debug samples when they are going to be logged
+        isDebug = logger.isEnabledFor(logging.DEBUG)
+
+        # stats of all collectives in one vectorized pass over the flat sizes
+        collNames = list(self.collInMsgSizes)
+        if len(collNames) > 0:
+            (order, bounds) = _groupBounds(self.coll_id, len(collNames))
+            inStats = _groupStats(self.sizes_in[order], bounds)
+            outStats = _groupStats(self.sizes_out[order], bounds)
+
+        for (i, name) in enumerate(collNames):
             print("-" * 50)
-            print(f"+ {len(msgSizes)} {name}")
+            print(f"+ {bounds[i + 1] - bounds[i]} {name}")
             print("-" * 50)
-            print(
-                f"Size of Input tensors (bytes)\n {'Total (MB)':>10} {'Max.':>15} {'Min.':>10} {'Average':>13} {'p50':>13} {'p95':>13}"
-            )
-            print(
-                "{:>10.2f} {:15.2f} {:10.2f} {:15.2f} {:15.2f} {:15.2f}".format(
-                    msgSizes.sum() / 1024 / 1024,
-                    msgSizes.max(),
-                    msgSizes.min(),
-                    np.average(msgSizes),
-                    np.percentile(msgSizes, 50),
-                    np.percentile(msgSizes, 95),
+            # input and output tensors
+            for (desc, stats, uniMsgSizes) in (
+                ("Input", inStats, self.collInUniMsgSizes[name]),
+                ("Output", outStats, self.collOutUniMsgSizes[name]),
+            ):
+                (total, maxSize, minSize, avgSize, p50, p95) = (
+                    stat[i] for stat in stats
                 )
-            )
-            logger.debug(f"  - Used sizes: {sorted(self.collInUniMsgSizes[name])}")
-
-            # output tensor
-            msgSizes = np.array(self.collOutMsgSizes[name])
-            print(
-                f"Size of Output tensors (bytes)\n {'Total (MB)':>10} {'Max.':>15} {'Min.':>10} {'Average':>13} {'p50':>13} {'p95':>13}"
-            )
-            print(
-                "{:>10.2f} {:15.2f} {:10.2f} {:15.2f} {:15.2f} {:15.2f}".format(
-                    msgSizes.sum() / 1024 / 1024,
-                    msgSizes.max(),
-                    msgSizes.min(),
-                    np.average(msgSizes),
-                    np.percentile(msgSizes, 50),
-                    np.percentile(msgSizes, 95),
+                print(
+                    f"Size of {desc} tensors (bytes)\n {'Total (MB)':>10} {'Max.':>15} {'Min.':>10} {'Average':>13} {'p50':>13} {'p95':>13}"
                 )
-            )
-            logger.debug(f"  - Used sizes: {sorted(self.collOutUniMsgSizes[name])}")
+                print(
+                    "{:>10.2f} {:15.2f} {:10.2f} {:15.2f} {:15.2f} {:15.2f}".format(
+                        total / 1024 / 1024, maxSize, minSize, avgSize, p50, p95
+                    )
+                )
+                if isDebug:
+                    logger.debug(f"  - Used sizes: {uniMsgSizes.tolist()}")
 
         if not self.is_dry_run:
             print("\n{} Performance of replayed comms {}".format("=" * 20, "=" * 20))
@@ -315,7 +681,7 @@ class commsTraceReplayBench(paramCommsBench):
                 if len(lats) == 0:
                     continue
 
-                Lat = np.array(lats)
+                Lat = np.asarray(lats)
                 print(
                     "{}\n Replayed {} {} ({:.2f}%): \n{}".format(
                         "-" * 50,
@@ -331,22 +697,22 @@ class commsTraceReplayBench(paramCommsBench):
                 )
                 print(
                     " {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f}".format(
-                        Lat.sum(),
-                        Lat.max(),
-                        Lat.min(),
-                        np.average(Lat),
-                        np.percentile(Lat, 50),
-                        np.percentile(Lat, 95),
+                        *_stats(Lat)
                     )
                 )
-                msgSizeAndLatency = (
-                    tuple(
-                        zip(lats, self.collInMsgSizes[coll], self.collOutMsgSizes[coll])
+                if isDebug:
+                    msgSizeAndLatency = (
+                        list(
+                            zip(
+                                Lat[:10].tolist(),
+                                self.collInMsgSizes[coll][:10].tolist(),
+                                self.collOutMsgSizes[coll][:10].tolist(),
+                            )
+                        )
+                        if coll in self.collInMsgSizes
+                        else Lat[:10].tolist()
                     )
-                    if coll in self.collInMsgSizes
-                    else lats
-                )
-                logger.debug(f"Latency and size of First ten: {msgSizeAndLatency[:10]}")
+                    logger.debug(f"Latency and size of First ten: {msgSizeAndLatency}")
 
             if self.colls_per_batch > 0:
                 print("\n{} Batch Latency Performance {}".format("=" * 20, "=" * 20))
@@ -356,12 +722,7 @@ class commsTraceReplayBench(paramCommsBench):
                 )
                 print(
                     " {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f} {:10.2f}".format(
-                        BatchLat.sum(),
-                        BatchLat.max(),
-                        BatchLat.min(),
-                        np.average(BatchLat),
-                        np.percentile(BatchLat, 50),
-                        np.percentile(BatchLat, 95),
+                        *_stats(BatchLat)
                     )
                 )
 
@@ -375,50 +736,70 @@ class commsTraceReplayBench(paramCommsBench):
         Returns:
             None
         """
-        maxInMsgsize = 0
-        maxOutMsgsize = 0
         self.num_msg = len(self.comms_trace)
         self.max_msg_cnt = self.num_msg if self.max_msg_cnt == 0 else self.max_msg_cnt
+        trace = self.comms_trace[: self.max_msg_cnt]
+        # sizes and collective ids (numbered in the order they first appear) of the comms that have sizes,
+        # preallocated for the whole trace and shrunk to the number of sized comms after the pass
+        sizedCollIds: Dict[str, int] = {}
+        collIds = np.empty(len(trace), dtype=np.int32)
+        inMsgSizes = np.empty(len(trace), dtype=np.int64)
+        outMsgSizes = np.empty(len(trace), dtype=np.int64)
+        numSized = 0
+        unknownDtypes = set()
+        self._eg_id_index = {}
         # first pass to know the statistics and get required info.
-        for curComm in self.comms_trace[: self.max_msg_cnt]:
+        for (cnt, curComm) in enumerate(trace):
             # record the current comm
             collName = paramToCommName(curComm.comms)
+            # index of the first comm of each execution graph node, for replaySingle()
+            if curComm.eg_id is not None:
+                self._eg_id_index.setdefault(curComm.eg_id, cnt)
+            # resolve the torch dtype once instead of at every prepComms()
+            if curComm.dtype is not None:
+                curComm.torchDtype = self.dtypeMap.get(curComm.dtype)
+                if curComm.torchDtype is None:
+                    unknownDtypes.add(curComm.dtype)
             curBlocks = curComm.markerStack if curComm.markerStack is not None else []
-            if collName not in self.collLat.keys():
-                self.collLat[collName] = []
-                # some ops don't have sizes
-                if curComm.inMsgSize is not None:
-                    self.collInMsgSizes[collName] = []
-                    self.collInUniMsgSizes[collName] = set()
-                    self.collOutMsgSizes[collName] = []
-                    self.collOutUniMsgSizes[collName] = set()
+            if collName not in self.collLat:
+                self.collLat[collName] = np.empty(0, dtype=np.float64)
+            # some ops don't have sizes
             if curComm.inMsgSize is not None:
-                self.collInMsgSizes[collName].append(curComm.inMsgSize)
-                self.collInUniMsgSizes[collName].add(curComm.inMsgSize)
-                self.collOutMsgSizes[collName].append(curComm.outMsgSize)
-                self.collOutUniMsgSizes[collName].add(curComm.outMsgSize)
-                maxInMsgsize = max(curComm.inMsgSize, maxInMsgsize)
-                maxOutMsgsize = max(curComm.outMsgSize, maxOutMsgsize)
+                collIds[numSized] = sizedCollIds.setdefault(collName, len(sizedCollIds))
+                inMsgSizes[numSized] = curComm.inMsgSize
+                outMsgSizes[numSized] = curComm.outMsgSize
+                numSized += 1
             # get info sorted by code block
             for curBlock in curBlocks:
                 if curBlock not in self.comms_blocks:
-                    self.comms_blocks[curBlock] = []
+                    self.comms_blocks[curBlock] = _newCommsBlock()
                 # only add entries if on dry run, otherwise, we'll deal with later during replay w/ more info
                 if self.is_dry_run:
-                    if collName not in ("wait", "barrier"):
-                        self.comms_blocks[curBlock].append(
-                            {
-                                "comms": collName,
-                                "in_msg_size": curComm.inMsgSize,
-                                "out_msg_size": curComm.outMsgSize,
-                            }
-                        )
-                    else:
-                        self.comms_blocks[curBlock].append(
-                            {
-                                "comms": collName,
-                            }
-                        )
+                    # wait and barrier have no sizes, i.e., None
+                    blockComms = self.comms_blocks[curBlock]
+                    blockComms["comms"].append(collName)
+                    blockComms["in_msg_size"].append(curComm.inMsgSize)
+                    blockComms["out_msg_size"].append(curComm.outMsgSize)
+
+        if len(unknownDtypes) > 0:
+            errMsg = f"Unsupported dtypes {sorted(unknownDtypes)} in trace {self.trace_file}, supported dtypes are {self.supportedDtype}"
+            if not self.is_dry_run:
+                raise ValueError(errMsg)
+            logger.warning(errMsg)
+
+        if numSized == 0:
+            return
+        self.coll_id = collIds[:numSized]
+        self.sizes_in = inMsgSizes[:numSized]
+        self.sizes_out = outMsgSizes[:numSized]
+        # group the sizes by collective in one vectorized pass instead of growing per-collective lists/sets
+        (order, bounds) = _groupBounds(self.coll_id, len(sizedCollIds))
+        for (i, collName) in enumerate(sizedCollIds):
+            idx = order[bounds[i] : bounds[i + 1]]
+            self.collInMsgSizes[collName] = self.sizes_in[idx]
+            self.collInUniMsgSizes[collName] = np.unique(self.sizes_in[idx])
+            self.collOutMsgSizes[collName] = self.sizes_out[idx]
+            self.collOutUniMsgSizes[collName] = np.unique(self.sizes_out[idx])
 
     def rebalanceSplit(self, curComm: commsArgs) -> None:
         """
@@ -432,9 +813,17 @@ class commsTraceReplayBench(paramCommsBench):
         if self.rebalance_policy == "equal":
             # Equally split sizes across ranks.
 
-            self.collectiveArgs.ipTensor = torch.tensor(
-                [curComm.inMsgSize], dtype=torch.int, device=self.collectiveArgs.device
-            )
+            # reuse a single element buffer on the device instead of allocating one per entry
+            if (
+                self._scratch_i32 is None
+                or self._scratch_device != self.collectiveArgs.device
+            ):
+                self._scratch_device = self.collectiveArgs.device
+                self._scratch_i32 = torch.empty(
+                    1, dtype=torch.int, device=self.collectiveArgs.device
+                )
+            self._scratch_i32.fill_(curComm.inMsgSize)
+            self.collectiveArgs.ipTensor = self._scratch_i32
             self.backendFuncs.collectiveFunc["all_reduce"](self.collectiveArgs)
             self.backendFuncs.complete_accel_ops(self.collectiveArgs)
             # in and out sizes are the same for equal splits.
@@ -448,9 +837,8 @@ class commsTraceReplayBench(paramCommsBench):
             curComm.inMsgSize = newInSize // self.collectiveArgs.world_size
             curComm.outMsgSize = curComm.inMsgSize
             curComm.inSplit = [
-                (curComm.inMsgSize // self.collectiveArgs.world_size)
-                for _ in range(self.collectiveArgs.world_size)
-            ]
+                curComm.inMsgSize // self.collectiveArgs.world_size
+            ] * self.collectiveArgs.world_size
             curComm.outSplit = curComm.inSplit
         else:
             logger.error("Unsupported balancing policy. Ignoring.")
@@ -461,6 +849,7 @@ class commsTraceReplayBench(paramCommsBench):
         """
         self.collectiveArgs.group = self.backendFuncs.get_default_group()
         self.world_size = self.backendFuncs.get_world_size()
+        self._pgInfoCache.clear()
 
     def getCommGroupInfo(
         self, curComm: commsArgs, commsParams: commsParamsHolderBase
@@ -469,24 +858,257 @@ class commsTraceReplayBench(paramCommsBench):
         Return the group infomation of the current process group
         including group rank of the local process, and a description string for logging purpose.
         A -1 group rank indicates an invalid process group on the local process.
+        The result is cached per PG until resetComms().
         """
+        key = curComm.pgId if not self.shrink else None
+        info = self._pgInfoCache.get(key)
+        if info is not None:
+            return info
 
         # If a PG is associated, the process needs to be included in the PG (group_rank != -1);
         # otherwise invalid communication to the local process.
-        if curComm.pgId is not None and not self.shrink:
-            group = self.collectiveArgs.groups[curComm.pgId]
-            groupDesc = f"PG: id={curComm.pgId}, world_ranks={commsParams.groupRanks[curComm.pgId]}"
+        if key is not None:
+            group = self.collectiveArgs.groups[key]
+            groupDesc = f"PG: id={key}, world_ranks={commsParams.groupRanks[key]}"
         else:
             group = self.backendFuncs.get_default_group()
             groupDesc = "PG: default group"
 
-        return (self.backendFuncs.get_group_rank(group), groupDesc)
+        info = (self.backendFuncs.get_group_rank(group), groupDesc)
+        self._pgInfoCache[key] = info
+        return info
+
+    def initDispatchPlan(self, commsParams: commsParamsHolderBase) -> None:
+        """
+        Precompute the per-entry dispatch info of the trace, i.e., the collective name (as a small int code),
+        group rank, group description and marker blocks, as well as the mask of entries to be replayed.
+        This keeps name normalization, PG lookups and allow-list checks out of the replay loop.
+
+        Args:
+            commsParams: Holds the process group ranks used to describe the PG of each entry.
+        Returns:
+            None
+        """
+        trace = self.comms_trace[: self.max_msg_cnt]
+        numComms = len(trace)
+        nameCodes: Dict[str, int] = {}
+        self.dispatchCodes = np.empty(numComms, dtype=np.int32)
+        self.dispatchGroupRanks = np.empty(numComms, dtype=np.int32)
+        self.dispatchGroupDescs = []
+        self.dispatchBlocks = []
+        blockStackCache = self._block_stack_cache
+        for cnt, curComm in enumerate(trace):
+            collName = paramToCommName(curComm.comms)
+            self.dispatchCodes[cnt] = nameCodes.setdefault(collName, len(nameCodes))
+            (groupRank, groupDesc) = self.getCommGroupInfo(curComm, commsParams)
+            self.dispatchGroupRanks[cnt] = groupRank
+            self.dispatchGroupDescs.append(groupDesc)
+            curBlocks = (
+                tuple(curComm.markerStack) if curComm.markerStack is not None else ()
+            )
+            # join the markers once per distinct marker stack
+            if curBlocks not in blockStackCache:
+                blockStackCache[curBlocks] = _joinBlockStack(curBlocks)
+            self.dispatchBlocks.append(curBlocks)
+        self.dispatchCollNames = list(nameCodes)
+
+        # Skip comm if the local process doesn't belong to the PG or encounter an unexpected collective
+        allowCodes = [
+            code
+            for (code, collName) in enumerate(self.dispatchCollNames)
+            if collName in self.allowList
+        ]
+        self.dispatchMask = np.isin(self.dispatchCodes, allowCodes) & (
+            self.dispatchGroupRanks != -1
+        )
+
+        # table of the entries to be replayed
+        self._prepared_trace = []
+        blockStackCache = self._block_stack_cache
+        collCounts: Dict[str, int] = dict.fromkeys(self.collLat, 0)
+        blockCounts: Dict[str, int] = dict.fromkeys(self.comms_blocks, 0)
+        for cnt in np.flatnonzero(self.dispatchMask).tolist():
+            curComm = trace[cnt]
+            curBlocks = self.dispatchBlocks[cnt]
+            curBlockStack = blockStackCache[curBlocks]
+            collName = self.dispatchCollNames[self.dispatchCodes[cnt]]
+            collCounts[collName] = collCounts.get(collName, 0) + 1
+            for curBlock in curBlocks:
+                blockCounts[curBlock] = blockCounts.get(curBlock, 0) + 1
+            baseRecord = None
+            if not self.shrink:
+                baseRecord = curComm.toDict()
+                baseRecord["marker_stack"] = curBlockStack
+            self._prepared_trace.append(
+                PreparedComm(
+                    cnt=cnt,
+                    curComm=curComm,
+                    collName=collName,
+                    groupRank=int(self.dispatchGroupRanks[cnt]),
+                    groupDesc=self.dispatchGroupDescs[cnt],
+                    curBlocks=curBlocks,
+                    curBlockStack=curBlockStack,
+                    baseRecord=baseRecord,
+                )
+            )
+
+        # preallocate the latencies and block record indices of all the replays
+        numReplays = max(self.num_replays, 1)
+        self.collLat_np = {
+            collName: np.empty(count * numReplays, dtype=np.float64)
+            for (collName, count) in collCounts.items()
+        }
+        self._lat_idx = dict.fromkeys(self.collLat_np, 0)
+        self.collLat = {
+            collName: arr[:0] for (collName, arr) in self.collLat_np.items()
+        }
+        self.blockRecordIdx = {
+            curBlock: np.empty(count * numReplays, dtype=np.int32)
+            for (curBlock, count) in blockCounts.items()
+        }
+        self._block_idx = dict.fromkeys(self.blockRecordIdx, 0)
+        self.perfCols = _newPerfCols(len(self._prepared_trace) * numReplays)
+        self.numPerfRecords = 0
+        self._shrinkRecords = {}
+
+        device = self.collectiveArgs.device
+        onCuda = (
+            device is not None
+            and torch.cuda.is_available()
+            and torch.device(device).type == "cuda"
+        )
+        # nonblocking entries do not wait for the previous ones,
+        # so the next tensors can be prepared on a side stream while the current one is recorded
+        self._prep_stream = (
+            torch.cuda.Stream(device=device)
+            if onCuda and not self.is_blocking and len(self._prepared_trace) > 1
+            else None
+        )
+
+        self._eventPool = []
+        if self.event_timing:
+            if onCuda:
+                self._eventPool = [
+                    (
+                        torch.cuda.Event(enable_timing=True),
+                        torch.cuda.Event(enable_timing=True),
+                    )
+                    for _ in self._prepared_trace
+                ]
+            else:
+                logger.warning(
+                    "--event-timing is only supported on CUDA devices, timing the collectives on the host instead"
+                )
+
+    def resetReplayStats(self) -> None:
+        """
+        Discard the timings recorded by replayTrace(), e.g., of the warm-up replays, keeping the preallocated buffers.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self._lat_idx = dict.fromkeys(self.collLat_np, 0)
+        self.collLat = {
+            collName: arr[:0] for (collName, arr) in self.collLat_np.items()
+        }
+        self._block_idx = dict.fromkeys(self.blockRecordIdx, 0)
+        self.numPerfRecords = 0
+        self._shrinkRecords = {}
+        self.batchLat = []
+        self.totalCommsLatency = 0.0
+
+    def warmUpByReplay(self) -> bool:
+        """
+        Whether benchTime() warms up with --warmup-replays replays of the prepared trace instead of warmUpBench().
+        warmUpBench() is kept when all_to_allv splits are rebalanced during warm-up, or with --auto-shrink
+        since the shrunk sizes are written back to the trace entries by every replay.
+
+        Args:
+            None
+        Returns:
+            bool: True if the warm-up replays the prepared trace.
+        """
+        return len(self.rebalance_policy) == 0 and not self.shrink
+
+    def numTracePasses(self) -> int:
+        """
+        Number of times replayTrace() replays the trace in benchTime(), including the warm-up replays.
+
+        Args:
+            None
+        Returns:
+            int: The number of replays.
+        """
+        warmups = (
+            self.warmup_replays if self.do_warm_up and self.warmUpByReplay() else 0
+        )
+        return self.num_replays + warmups
+
+    def reservePerfRecords(self, numRecords: int) -> None:
+        """
+        Make sure perfCols has room for numRecords more rows, growing all columns together if needed.
+
+        Args:
+            numRecords: Number of rows to be recorded.
+        Returns:
+            None
+        """
+        capacity = len(self.perfCols["prepared_idx"])
+        needed = self.numPerfRecords + numRecords
+        if needed <= capacity:
+            return
+        # more rows than planned, e.g., replayTrace() called more than num_replays times
+        newPerfCols = _newPerfCols(max(needed, 2 * capacity))
+        for (col, arr) in self.perfCols.items():
+            newPerfCols[col][: self.numPerfRecords] = arr[: self.numPerfRecords]
+        self.perfCols = newPerfCols
+
+    def iterTraceWithPerf(self) -> Iterator[Dict]:
+        """
+        Yield the replayed records, i.e., the trace entries with their timings, from perfCols.
+        Each record is built only when requested, so a writer can stream them out one at a time.
+
+        Args:
+            None
+        Returns:
+            Iterator[Dict]: One record per replayed comm in the replayed order.
+        """
+        numRecords = self.numPerfRecords
+        preparedIdx = self.perfCols["prepared_idx"][:numRecords].tolist()
+        timeCols = [
+            (col, self.perfCols[col][:numRecords].tolist()) for col in PERF_TIME_COLS
+        ]
+        prepared_trace = self._prepared_trace
+        shrinkRecords = self._shrinkRecords
+        for (i, idx) in enumerate(preparedIdx):
+            baseRecord = prepared_trace[idx].baseRecord
+            recordComm = (
+                baseRecord.copy() if baseRecord is not None else shrinkRecords[i]
+            )
+            for (col, values) in timeCols:
+                recordComm[col] = values[i]
+            yield recordComm
+
+    def getTraceWithPerf(self) -> List[Dict]:
+        """
+        Build the replayed records, i.e., the trace entries with their timings, from perfCols.
+
+        Args:
+            None
+        Returns:
+            List[Dict]: One record per replayed comm in the replayed order.
+        """
+        return list(self.iterTraceWithPerf())
 
     def prepComms(
         self,
         curComm: commsArgs,
         commsParams: commsParamsHolderBase,
         regenerateTensors: bool = True,
+        pooled: bool = False,
+        cacheKey: Optional[int] = None,
     ) -> (torch.Tensor, torch.Tensor):
         """
         Prepares the appropriate tensors for the current collective communication.
@@ -495,6 +1117,9 @@ class commsTraceReplayBench(paramCommsBench):
             curComm: The current communication that we are preparing the correct tensor for.
             commsParams: Holds the comms param arguments that will determine tensor attributes.
             regenerateTensors: when a eg_id is being replayed multiple times, setting this to false will use temsors from previous runs
+            pooled: Take the tensors from the tensor pool if possible, the caller has to call releaseTensors()
+                    once the collective is completed.
+            cacheKey: Reuse the tensors cached under this key by a previous call, allocate and cache them if not present.
         Returns:
             (ipTensor, opTensor) if the current communication requires tensors, None otherwise.
         """
@@ -559,7 +1184,22 @@ class commsTraceReplayBench(paramCommsBench):
                 f"shrink message sizes to curInNumElem {curComm.inMsgSize}, curOutNumElem {curComm.outMsgSize}"
             )
 
-        commsParams.dtype = self.dtypeMap[curComm.dtype]
+        commsParams.dtype = (
+            curComm.torchDtype
+            if curComm.torchDtype is not None
+            else self.dtypeMap[curComm.dtype]
+        )
+        if pooled and commOp in POOLED_INPLACE_COLLS + POOLED_OUTOFPLACE_COLLS:
+            return self.prepPooledComm(curComm, commsParams, commOp)
+
+        if cacheKey is not None:
+            if cacheKey in self._tensor_cache:
+                # only set up the non-tensor fields, e.g., all_to_allv splits
+                super().prepComm(curComm, commsParams, False)
+                return self._tensor_cache[cacheKey]
+            self._tensor_cache[cacheKey] = super().prepComm(curComm, commsParams)
+            return self._tensor_cache[cacheKey]
+
         if not curComm.eg_id:
             return super().prepComm(curComm, commsParams)
 
@@ -575,6 +1215,66 @@ class commsTraceReplayBench(paramCommsBench):
                 self.eg_to_tensors[curComm.eg_id] = (ipTensor, opTensor)
         return (ipTensor, opTensor)
 
+    def prepPooledComm(
+        self, curComm: commsArgs, commsParams: commsParamsHolderBase, commOp: str
+    ) -> (torch.Tensor, torch.Tensor):
+        """
+        Prepares the tensors of a collective in POOLED_INPLACE_COLLS or POOLED_OUTOFPLACE_COLLS,
+        reusing the buffers released by previous entries with the same size, dtype and device.
+
+        Args:
+            curComm: The current communication that we are preparing the correct tensor for.
+            commsParams: Holds the comms param arguments that will determine tensor attributes.
+            commOp: Normalized name of the collective.
+        Returns:
+            (ipTensor, opTensor)
+        """
+        # set up the non-tensor fields only, e.g., all_to_allv splits
+        super().prepComm(curComm, commsParams, False)
+
+        dtype = commsParams.dtype
+        curDevice = commsParams.device
+        numElementsIn = curComm.inMsgSize
+        numElementsOut = curComm.outMsgSize
+        scaleFactor = numElementsOut * numElementsOut
+
+        key = (numElementsIn, dtype, curDevice)
+        if self._tensorPool[key]:
+            ipTensor = self._tensorPool[key].pop()
+            # in-place collectives overwrite the input, restore predictable values for data validation check
+            if commsParams.dcheck == 1:
+                ipTensor.fill_(self.initVal)
+        elif commsParams.dcheck == 1:
+            ipTensor = self.backendFuncs.alloc_ones(
+                [numElementsIn], curDevice, dtype, scaleFactor=self.initVal
+            )
+        else:
+            ipTensor = self.backendFuncs.alloc_random(
+                [numElementsIn], curDevice, dtype, scaleFactor
+            )
+        self._pooledInUse.append((key, ipTensor))
+
+        if commOp in POOLED_INPLACE_COLLS:
+            return (ipTensor, ipTensor)
+
+        key = (numElementsOut, dtype, curDevice)
+        if self._tensorPool[key]:
+            opTensor = self._tensorPool[key].pop()
+        else:
+            opTensor = self.backendFuncs.alloc_random(
+                [numElementsOut], curDevice, dtype, scaleFactor
+            )
+        self._pooledInUse.append((key, opTensor))
+        return (ipTensor, opTensor)
+
+    def releaseTensors(self) -> None:
+        """
+        Return the pooled tensors of the completed entries to the tensor pool.
+        """
+        for (key, tensor) in self._pooledInUse:
+            self._tensorPool[key].append(tensor)
+        self._pooledInUse.clear()
+
     def warmUpBench(self, commsParams: commsParamsHolderBase) -> None:
         """
         Replays collectives without recording statistics to warm up devices.
@@ -584,36 +1284,48 @@ class commsTraceReplayBench(paramCommsBench):
         Returns:
             None
         """
-        for cnt, curComm in enumerate(self.comms_trace[: self.max_msg_cnt]):
+        # bind the attributes used per entry to locals
+        collectiveArgs = self.collectiveArgs
+        backendFuncs = self.backendFuncs
+        collectiveFunc = backendFuncs.collectiveFunc
+        allowList = self.allowList
+        is_blocking = self.is_blocking
+        max_msg_cnt = self.max_msg_cnt
+        isInfo = logger.isEnabledFor(logging.INFO)
+        for cnt, curComm in enumerate(self.comms_trace[:max_msg_cnt]):
             # Make a copy of the comm to not modify it before real run.
-            commEntry = copy.deepcopy(curComm)
+            # A shallow copy is enough since prepComms() only reassigns fields and never mutates them in place.
+            commEntry = copy.copy(curComm)
             commName = paramToCommName(commEntry.comms)
 
             (groupRank, groupDesc) = self.getCommGroupInfo(commEntry, commsParams)
             # Skip comm if the local process doesn't belong to the PG or encounter an unexpected collective
-            if commName not in self.allowList or groupRank == -1:
+            if commName not in allowList or groupRank == -1:
                 continue
 
-            if groupRank == 0:
+            if isInfo and groupRank == 0:
                 logger.info(
-                    f"[Warm-up][{cnt} / {self.max_msg_cnt}] Replaying {commName:>10} with {groupDesc}..."
+                    "[Warm-up][%d / %d] Replaying %10s with %s...",
+                    cnt,
+                    max_msg_cnt,
+                    commName,
+                    groupDesc,
                 )
 
             # read fields and prepare the tensors
-            (
-                self.collectiveArgs.ipTensor,
-                self.collectiveArgs.opTensor,
-            ) = self.prepComms(commEntry, commsParams)
+            (collectiveArgs.ipTensor, collectiveArgs.opTensor) = self.prepComms(
+                commEntry, commsParams, pooled=is_blocking
+            )
 
             # Rebalance all_to_allv if a policy is specified.
             if (
-                commName in self.backendFuncs.collectiveFunc.keys()
+                commName in collectiveFunc
                 and commName == "all_to_allv"
                 and len(self.rebalance_policy) > 0
             ):
                 # We need to set world_size correctly for rebalancing.
-                self.collectiveArgs.world_size = (
-                    self.backendFuncs.get_world_size()
+                collectiveArgs.world_size = (
+                    backendFuncs.get_world_size()
                     if commEntry.pgId is None or self.shrink
                     else commEntry.worldSize
                 )
@@ -621,19 +1333,24 @@ class commsTraceReplayBench(paramCommsBench):
                 self.rebalanceSplit(curComm)
 
                 # Rebalancing invalidated tensors, prep them again.
-                (
-                    self.collectiveArgs.ipTensor,
-                    self.collectiveArgs.opTensor,
-                ) = self.prepComms(commEntry, commsParams)
+                (collectiveArgs.ipTensor, collectiveArgs.opTensor) = self.prepComms(
+                    commEntry, commsParams, pooled=is_blocking
+                )
 
-            if commName in self.backendFuncs.collectiveFunc.keys():
-                self.backendFuncs.collectiveFunc[commName](self.collectiveArgs)
+            if commName in collectiveFunc:
+                collectiveFunc[commName](collectiveArgs)
             # skip not supported ops
 
-            self.backendFuncs.complete_accel_ops(self.collectiveArgs)
+            backendFuncs.complete_accel_ops(collectiveArgs)
+            if is_blocking:
+                self.releaseTensors()
 
     def runComms(
-        self, collName: str, curComm: commsArgs, curBlockStack: str
+        self,
+        collName: str,
+        curComm: commsArgs,
+        curBlockStack: str,
+        events: Optional[Tuple[torch.cuda.Event, torch.cuda.Event]] = None,
     ) -> (float, float):
         """
         Replays collective communication operation and records metrics for benchmarking.
@@ -642,52 +1359,65 @@ class commsTraceReplayBench(paramCommsBench):
             collName: Name of collective that is going to be replayed.
             curComm: Object containing information on the current collective.
             curBlockStack: str containg the marker_stack(s) that this collective is a part of
+            events: (start, end) CUDA events to record around the collective on the current stream, if not None.
         Returns:
             (latency, global_latency), returns the timings of how long the replay or posting (if nonblocking) of the collective took.
         """
-        self.collectiveArgs.quant_time.reset()
-        self.collectiveArgs.dequant_time.reset()
+        collectiveArgs = self.collectiveArgs
+        backendFuncs = self.backendFuncs
+        collectiveFunc = backendFuncs.collectiveFunc
+        is_blocking = self.is_blocking
+
+        collectiveArgs.quant_time.reset()
+        collectiveArgs.dequant_time.reset()
         collTimer = paramTimer()
+        # the profiler ranges are only recorded when the profiler is on, otherwise just time the collective
+        fastTiming = not torch.autograd._profiler_enabled()
 
-        if self.is_blocking:
-            self.backendFuncs.sync_barrier(self.collectiveArgs)
+        if is_blocking:
+            backendFuncs.sync_barrier(collectiveArgs)
 
         # replay the collective
         with paramProfile(
-            timer=collTimer, description="# PARAM replay: " + curBlockStack
+            timer=collTimer,
+            description="# PARAM replay: " + curBlockStack,
+            fast=fastTiming,
         ):
-            if collName in self.backendFuncs.collectiveFunc.keys():
+            if events is not None:
+                events[0].record()
+            if collName in collectiveFunc:
                 # record collectiveID for wait ops
                 if curComm.req is not None:
-                    self.collectiveArgs.collectiveId = curComm.req
+                    collectiveArgs.collectiveId = curComm.req
 
-                retObj = self.backendFuncs.collectiveFunc[collName](
-                    self.collectiveArgs, retFlag=True
-                )
+                retObj = collectiveFunc[collName](collectiveArgs, retFlag=True)
             else:
                 # skip not supported ops
-                logger.warn(
-                    f"Unsupported collective name: {collName}. Skipping replaying the collective"
+                logger.warning(
+                    "Unsupported collective name: %s. Skipping replaying the collective",
+                    collName,
                 )
 
             # if blocking, post outstanding ops and wait for them to complete. if nonblocking, just post op
-            self.backendFuncs.complete_accel_ops(
-                self.collectiveArgs, devSync=self.is_blocking
-            )
+            backendFuncs.complete_accel_ops(collectiveArgs, devSync=is_blocking)
+            if events is not None:
+                # recorded after the waits so the current stream has to see the collective complete
+                events[1].record()
 
             # if nonblocking, then store the pair {reqID, future} so that we can wait on it later
             # check if req id is recorded in trace for backwards compatibility
-            if curComm.req is not None and not self.is_blocking and collName != "wait":
-                self.collectiveArgs.waitObjIds[curComm.req] = retObj
+            if curComm.req is not None and not is_blocking and collName != "wait":
+                collectiveArgs.waitObjIds[curComm.req] = retObj
 
         # For non-blocking, latency and global_latency are the same
         global_latency = latency = collTimer.getTimeUS()
 
-        if self.is_blocking:
+        if is_blocking:
             with paramProfile(
-                description="# PARAM replay barrier # " + curBlockStack
+                description="# PARAM replay barrier # " + curBlockStack,
+                fast=fastTiming,
             ) as bt:
-                self.backendFuncs.sync_barrier(self.collectiveArgs)
+                backendFuncs.sync_barrier(collectiveArgs)
 
             # We sync the global_latency for blocking
             global_latency = latency + (bt.intervalNS / 1e3)
@@ -706,11 +1436,15 @@ class commsTraceReplayBench(paramCommsBench):
         """
         # sleep for until it is time for the next collective to run
         # if the collective is less than LOOP_TIMER_S (.02s) away, continue looping for the duration. This is because of time.sleep()'s accuracy.
-        if curComm.startTimeNs is not None:  # for backwards compatibility
-            while time.monotonic_ns() - startTime <= curComm.startTimeNs:
-                timeDiff = curComm.startTimeNs - (time.monotonic_ns() - startTime)
-                if timeDiff / 1e9 >= LOOP_TIMER_S:  # make it seconds
-                    time.sleep(LOOP_TIMER_S)
+        if curComm.startTimeNs is None:  # for backwards compatibility
+            return
+        deadline = startTime + curComm.startTimeNs
+        while True:
+            remaining = deadline - time.monotonic_ns()
+            if remaining < 0:
+                return
+            if remaining >= LOOP_TIMER_NS:
+                time.sleep(LOOP_TIMER_S)
 
     def replayTrace(self, commsParams: commsParamsHolderBase) -> None:
         """
@@ -722,89 +1456,206 @@ class commsTraceReplayBench(paramCommsBench):
             None
         """
         coll_in_batch_num = 0
+        # bind the attributes used per entry to locals
+        collectiveArgs = self.collectiveArgs
+        # the timers are reset, not replaced, by runComms()
+        quantTime = collectiveArgs.quant_time
+        dequantTime = collectiveArgs.dequant_time
+        globalRank = collectiveArgs.global_rank
+        prepComms = self.prepComms
+        runComms = self.runComms
+        waitForTimestamp = self.waitForTimestamp
+        checkData = self.dcheck
+        releaseTensors = self.releaseTensors
+        is_blocking = self.is_blocking
+        colls_per_batch = self.colls_per_batch
+        use_timestamp = self.use_timestamp
+        max_msg_cnt = self.max_msg_cnt
+        dcheck = commsParams.dcheck
+        collLat_np = self.collLat_np
+        lat_idx = self._lat_idx
+        blockRecordIdx = self.blockRecordIdx
+        block_idx = self._block_idx
+        batchLat = self.batchLat
+        totalCommsLatency = 0.0
+        # skip building the log messages if they would be dropped anyway
+        isInfo = logger.isEnabledFor(logging.INFO)
+        logReplayed = isInfo and self._is_rank0
+        # nonblocking replays can not pool tensors, instead keep the tensors of each entry for the next replays.
+        # skipped with data validation check since in-place collectives overwrite their input.
+        cacheTensors = not is_blocking and dcheck != 1 and self.numTracePasses() > 1
+        # room for one row per replayed comm, written by index in the loop
+        self.reservePerfRecords(len(self._prepared_trace))
+        perfCols = self.perfCols
+        quantCol = perfCols["quant_us"]
+        dequantCol = perfCols["dequant_us"]
+        latencyCol = perfCols["latency_us"]
+        globalLatencyCol = perfCols["global_latency_us"]
+        preparedIdxCol = perfCols["prepared_idx"]
+        recordIdx = self.numPerfRecords
+        shrinkRecords = self._shrinkRecords
+        eventPool = self._eventPool
+        prepared_trace = self._prepared_trace
+        numPrepared = len(prepared_trace)
+        prepStream = self._prep_stream
+        currentStream = torch.cuda.current_stream() if prepStream is not None else None
+        # tensors of the next entry prepared on prepStream, see below
+        nextTensors = None
+        # (prepared entry, row of perfCols, index in collLat_np) of the comms timed by events
+        eventRows = []
         startTime = time.monotonic_ns()
-        for cnt, curComm in enumerate(self.comms_trace[: self.max_msg_cnt]):
-            collName = paramToCommName(curComm.comms)
-
-            (groupRank, groupDesc) = self.getCommGroupInfo(curComm, commsParams)
-            # Skip comm if the local process doesn't belong to the PG or encounter an unexpected collective
-            if collName not in self.allowList or groupRank == -1:
-                continue
-
-            curBlocks = curComm.markerStack if curComm.markerStack is not None else []
-            curBlockStack = (
-                " ".join(curBlocks) if len(curBlocks) > 0 else "Unamed/Unknown"
-            )
-
-            if groupRank == 0:
+        # only visit the entries to be replayed, see initDispatchPlan()
+        for (preparedIdx, prepared) in enumerate(prepared_trace):
+            cnt = prepared.cnt
+            curComm = prepared.curComm
+            collName = prepared.collName
+            groupRank = prepared.groupRank
+            groupDesc = prepared.groupDesc
+            curBlocks = prepared.curBlocks
+            curBlockStack = prepared.curBlockStack
+
+            if isInfo and groupRank == 0:
                 logger.info(
-                    f"[Rank {self.collectiveArgs.global_rank:3}] [{cnt} / {self.max_msg_cnt}] Replaying {str(curComm.comms)} with {groupDesc}"
+                    "[Rank %3d] [%d / %d] Replaying %s with %s",
+                    globalRank,
+                    cnt,
+                    max_msg_cnt,
+                    curComm.comms,
+                    groupDesc,
                 )
 
-            # read fields and prepare the tensors
-            (
-                self.collectiveArgs.ipTensor,
-                self.collectiveArgs.opTensor,
-            ) = self.prepComms(curComm, commsParams)
+            # read fields and prepare the tensors, blocking collectives are completed before the next entry
+            # so their tensors can be reused
+            if nextTensors is not None:
+                # already prepared on prepStream during the previous entry
+                currentStream.wait_stream(prepStream)
+                (collectiveArgs.ipTensor, collectiveArgs.opTensor) = nextTensors
+                nextTensors = None
+            else:
+                (collectiveArgs.ipTensor, collectiveArgs.opTensor) = prepComms(
+                    curComm,
+                    commsParams,
+                    pooled=is_blocking,
+                    cacheKey=cnt if cacheTensors else None,
+                )
 
-            if self.colls_per_batch > 0 and coll_in_batch_num == 0:
-                batch_begin = time.monotonic()
+            if colls_per_batch > 0 and coll_in_batch_num == 0:
+                batch_begin = time.perf_counter_ns()
 
             # wait for collective timestamp if enabled.
-            if self.use_timestamp:
-                self.waitForTimestamp(curComm, startTime)
+            if use_timestamp:
+                waitForTimestamp(curComm, startTime)
 
             # send comm request to pytorch backend
-            (latency, global_latency) = self.runComms(collName, curComm, curBlockStack)
+            (latency, global_latency) = runComms(
+                collName,
+                curComm,
+                curBlockStack,
+                events=eventPool[preparedIdx] if eventPool else None,
+            )
+
+            # only nonblocking: prepare the next tensors before the host work of this entry,
+            # so the next collective can be posted right after
+            if prepStream is not None and preparedIdx + 1 < numPrepared:
+                nextPrepared = prepared_trace[preparedIdx + 1]
+                # the cached tensors of the next entry may still be in use by the queued work
+                prepStream.wait_stream(currentStream)
+                with torch.cuda.stream(prepStream):
+                    nextTensors = prepComms(
+                        nextPrepared.curComm,
+                        commsParams,
+                        cacheKey=nextPrepared.cnt if cacheTensors else None,
+                    )
+                for tensors in nextTensors:
+                    _recordStream(tensors, currentStream)
 
             # perform data validation check on the final opTensor
-            if (
-                self.is_blocking
-                and commsParams.dcheck == 1
-                and collName not in ("wait", "barrier")
-            ):
+            if is_blocking and dcheck == 1 and collName not in ("wait", "barrier"):
                 commsParams.collective = collName
                 commsParams.srcOrDst = curComm.root if curComm.root is not None else 0
-                self.dcheck(
-                    commsParams, curComm.outMsgSize, self.collectiveArgs.opTensor
-                )
+                checkData(commsParams, curComm.outMsgSize, collectiveArgs.opTensor)
+            if is_blocking:
+                releaseTensors()
 
             # calculating batch latency (batch defined by --colls-per-batch)
-            if collName == "wait" and self.colls_per_batch > 0:
+            if collName == "wait" and colls_per_batch > 0:
                 coll_in_batch_num += 1
-                if coll_in_batch_num == self.colls_per_batch:
+                if coll_in_batch_num == colls_per_batch:
                     batch_latency = (
-                        time.monotonic() - batch_begin
-                    ) * 1e3  # make it millisecond
+                        time.perf_counter_ns() - batch_begin
+                    ) / 1e6  # make it millisecond
                     coll_in_batch_num = 0
-                    self.batchLat.append(batch_latency)
+                    batchLat.append(batch_latency)
 
             # record comm metrics
-            self.collLat[collName].append(latency)
-            self.totalCommsLatency += latency
-
-            recordComm = curComm.toDict()
-
-            recordComm["marker_stack"] = curBlockStack
-            recordComm["quant_us"] = self.collectiveArgs.quant_time.getTimeUS()
-            recordComm["dequant_us"] = self.collectiveArgs.dequant_time.getTimeUS()
-            recordComm["latency_us"] = latency
-            recordComm["global_latency_us"] = global_latency
+            _appendPrealloc(collLat_np, lat_idx, collName, latency)
+            totalCommsLatency += latency
+            if eventPool:
+                eventRows.append((preparedIdx, recordIdx, lat_idx[collName] - 1))
+
+            # Keep the timings of the comm, the replayed record is built by getTraceWithPerf()
+            if prepared.baseRecord is None:
+                # the sizes may have been changed by prepComms()
+                recordComm = curComm.toDict()
+                recordComm["marker_stack"] = curBlockStack
+                shrinkRecords[recordIdx] = recordComm
+            quantCol[recordIdx] = quantTime.getTimeUS()
+            dequantCol[recordIdx] = dequantTime.getTimeUS()
+            latencyCol[recordIdx] = latency
+            globalLatencyCol[recordIdx] = global_latency
+            preparedIdxCol[recordIdx] = preparedIdx
 
             # record comm block metrics
             # categorized by the marker
             for curBlock in curBlocks:
-                # elem_size = self.collectiveArgs.ipTensor.element_size()
-                self.comms_blocks[curBlock].append(recordComm)
+                # elem_size = collectiveArgs.ipTensor.element_size()
+                _appendPrealloc(blockRecordIdx, block_idx, curBlock, recordIdx)
+            recordIdx += 1
 
-            # Keep a copy of trace with performance (latency) and seqnum
-            self.traceWithPerf.append(recordComm)
-
-            if self.backendFuncs.get_global_rank() == 0:
+            if logReplayed:
                 logger.info(
-                    f"[{cnt} / {self.max_msg_cnt}] Replayed {collName} in block [{curBlockStack}]... {global_latency:.2f} us"
+                    "[%d / %d] Replayed %s in block [%s]... %.2f us",
+                    cnt,
+                    max_msg_cnt,
+                    collName,
+                    curBlockStack,
+                    global_latency,
                 )
 
+        if eventRows:
+            totalCommsLatency += self.applyEventTimings(eventRows)
+        self.totalCommsLatency += totalCommsLatency
+        self.numPerfRecords = recordIdx
+        self.collLat = {
+            collName: arr[: lat_idx[collName]] for (collName, arr) in collLat_np.items()
+        }
+
+    def applyEventTimings(self, eventRows: List[Tuple[int, int, int]]) -> float:
+        """
+        Replace the host latencies of the comms replayed with --event-timing by the time between their CUDA events.
+        For nonblocking comms the global latency is the latency, so it is replaced as well.
+
+        Args:
+            eventRows: (index in the prepared trace, row of perfCols, index in collLat_np) of each timed comm.
+        Returns:
+            float: Change of the sum of latencies in us.
+        """
+        # wait once for all the events of the replay
+        torch.cuda.synchronize()
+        latencyCol = self.perfCols["latency_us"]
+        globalLatencyCol = self.perfCols["global_latency_us"]
+        delta = 0.0
+        for (preparedIdx, recordIdx, latIdx) in eventRows:
+            (start, end) = self._eventPool[preparedIdx]
+            latency = start.elapsed_time(end) * 1e3  # make it us
+            delta += latency - latencyCol[recordIdx]
+            latencyCol[recordIdx] = latency
+            if not self.is_blocking:
+                globalLatencyCol[recordIdx] = latency
+            collName = self._prepared_trace[preparedIdx].collName
+            self.collLat_np[collName][latIdx] = latency
+        return float(delta)
+
     def replaySingle(
         self, commsParams: commsParamsHolderBase, eg_id: int, regenerateTensors: True
     ) -> torch.tensor:
@@ -817,50 +1668,53 @@ class commsTraceReplayBench(paramCommsBench):
         Returns:
             Output tensor.
         """
-        for _, curComm in enumerate(self.comms_trace[: self.max_msg_cnt]):
-            if curComm.eg_id == eg_id:
-                collName = paramToCommName(curComm.comms)
-                if collName not in self.allowList:
-                    return
-
-                curBlocks = (
-                    curComm.markerStack if curComm.markerStack is not None else []
-                )
-                curBlockStack = (
-                    " ".join(curBlocks) if len(curBlocks) > 0 else "Unamed/Unknown"
-                )
+        idx = self._eg_id_index.get(eg_id)
+        if idx is None:
+            return
+        curComm = self.comms_trace[idx]
+        collName = paramToCommName(curComm.comms)
+        if collName not in self.allowList:
+            return
+
+        curBlocks = (
+            tuple(curComm.markerStack) if curComm.markerStack is not None else ()
+        )
+        curBlockStack = self._block_stack_cache.get(curBlocks)
+        if curBlockStack is None:
+            curBlockStack = self._block_stack_cache[curBlocks] = _joinBlockStack(
+                curBlocks
+            )
 
-                if self.backendFuncs.get_global_rank() == 0:
-                    logger.debug(
-                        f"[Rank {self.collectiveArgs.global_rank:3}] Replaying \n{str(curComm.comms)}\n"
-                    )
+        collectiveArgs = self.collectiveArgs
+        if (
+            logger.isEnabledFor(logging.DEBUG)
+            and self.backendFuncs.get_global_rank() == 0
+        ):
+            logger.debug(
+                "[Rank %3d] Replaying \n%s\n",
+                collectiveArgs.global_rank,
+                curComm.comms,
+            )
 
-                # read fields and prepare the tensors
-                (
-                    self.collectiveArgs.ipTensor,
-                    self.collectiveArgs.opTensor,
-                ) = self.prepComms(curComm, commsParams, regenerateTensors)
+        # read fields and prepare the tensors
+        (collectiveArgs.ipTensor, collectiveArgs.opTensor) = self.prepComms(
+            curComm, commsParams, regenerateTensors
+        )
 
-                # send comm request to pytorch backend
-                (latency, global_latency) = self.runComms(
-                    collName, curComm, curBlockStack
-                )
+        # send comm request to pytorch backend
+        (latency, global_latency) = self.runComms(collName, curComm, curBlockStack)
 
-                # perform data validation check on the final opTensor
-                if (
-                    self.is_blocking
-                    and commsParams.dcheck == 1
-                    and collName not in ("wait", "barrier")
-                ):
-                    commsParams.collective = collName
-                    commsParams.srcOrDst = (
-                        curComm.root if curComm.root is not None else 0
-                    )
-                    self.dcheck(
-                        commsParams, curComm.outMsgSize, self.collectiveArgs.opTensor
-                    )
+        # perform data validation check on the final opTensor
+        if (
+            self.is_blocking
+            and commsParams.dcheck == 1
+            and collName not in ("wait", "barrier")
+        ):
+            commsParams.collective = collName
+            commsParams.srcOrDst = curComm.root if curComm.root is not None else 0
+            self.dcheck(commsParams, curComm.outMsgSize, collectiveArgs.opTensor)
 
-                return self.collectiveArgs.opTensor
+        return collectiveArgs.opTensor
 
     def benchTime(self, commsParams: commsParamsHolderBase) -> None:
         """
@@ -912,38 +1766,63 @@ class commsTraceReplayBench(paramCommsBench):
         Returns:
             None
         """
+        # only rank 0 logs the replay progress, the rank does not change during the run
+        self._is_rank0 = self.backendFuncs.get_global_rank() == 0
+
         # warm-up
-        if self.do_warm_up:
+        warmUpByReplay = self.warmUpByReplay()
+        if self.do_warm_up and not warmUpByReplay:
+            # may rebalance the trace entries, so it runs before their records are prepared
             self.warmUpBench(commsParams)
+
+        self.initDispatchPlan(commsParams)
+
+        if self.do_warm_up and warmUpByReplay:
+            # replay the prepared trace, which also fills the tensor pool and cache for the real runs
+            for i in range(self.warmup_replays):
+                if self._is_rank0:
+                    logger.info("Warm-up replay #%d", i)
+                self.replayTrace(commsParams)
+                self.resetComms()
+            self.resetReplayStats()
         self.resetComms()
 
         # sync everything before starting real runs
         self.backendFuncs.sync_barrier(self.collectiveArgs)
 
-        if self.backendFuncs.get_global_rank() == 0:
+        if self._is_rank0:
             logger.info(
-                f"\n+ {self.max_msg_cnt} messages in the trace...replaying (if present) {list(self.allowList)}"
+                "\n+ %d messages in the trace...replaying (if present) %s",
+                self.max_msg_cnt,
+                sorted(self.allowList),
             )
             for coll, sizes in self.collInMsgSizes.items():
-                logger.info(f"\t{coll}: {len(sizes)}")
+                logger.info("\t%s: %d", coll, len(sizes))
 
-        traceStartTime = time.monotonic_ns()
+        traceStartTime = time.perf_counter_ns()
         for i in range(self.num_replays):
-            if self.backendFuncs.get_global_rank() == 0:
-                logger.info(f"Replay #{i}")
+            if self._is_rank0:
+                logger.info("Replay #%d", i)
 
             # replay comms trace
             self.replayTrace(commsParams)
             self.resetComms()
 
-            # make sure all ops are completed, in the case of nonblocking, this will enqueue all remaining operations that did not have a wait op
-            self.backendFuncs.sync_barrier(self.collectiveArgs)
+            # optionally sync ranks between replays, the barrier cost is then part of the measured latency
+            if self.inter_replay_barrier and i < self.num_replays - 1:
+                self.backendFuncs.sync_barrier(self.collectiveArgs)
+
+        # make sure all ops are completed, in the case of nonblocking, this will enqueue all remaining operations that did not have a wait op
+        self.backendFuncs.sync_barrier(self.collectiveArgs)
 
         # record how long it took for trace-replay to complete
-        traceEndTime = time.monotonic_ns()
+        traceEndTime = time.perf_counter_ns()
         self.totalTraceLatency = (traceEndTime - traceStartTime) / 1e3  # make it us
 
         # cleanup any memory left in use
+        self._pooledInUse.clear()
+        self._tensorPool.clear()
+        self._tensor_cache.clear()
         self.backendFuncs.clear_memory(self.collectiveArgs)
 
     def runBench(
@@ -967,12 +1846,15 @@ class commsTraceReplayBench(paramCommsBench):
         logger.info(
             f"[Rank-{comms_world_info.global_rank}] reading trace from {self.trace_file}"
         )
-        self.readTrace(remotePath=self.trace_file)
+        # read the trace in the background while the backend is being initialized
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            traceFuture = executor.submit(self.loadTrace)
+            # only setup and perform collectives if not dry run mode
+            if not self.is_dry_run:
+                self.setBench(comms_world_info, commsParams, traceFuture=traceFuture)
+            traceFuture.result()
 
-        self.initTraceStat()
-        # only setup and perform collectives if not dry run mode
         if not self.is_dry_run:
-            self.setBench(comms_world_info, commsParams)
             # start benchmark
             self.benchTime(commsParams)
         elif comms_world_info.global_rank == 0:
@@ -987,9 +1869,11 @@ class commsTraceReplayBench(paramCommsBench):
 
         if not self.is_dry_run:
             writeCommDetails(
-                self.traceWithPerf,
-                folder=self.out_path,
+                self.iterTraceWithPerf(),
+                folder=self._out_dir,
                 rank=comms_world_info.global_rank,
+                isRemote=self._out_is_remote,
+                jsonLines=not self.legacy_json,
             )
             # TODO: collect perf. from all ranks to rank 0 and detect any imbalanced perf?
             self.backendFuncs.barrier(self.collectiveArgs)
@@ -1014,17 +1898,45 @@ class commsTraceReplayBench(paramCommsBench):
         logger.info(
             f"[Rank-{comms_world_info.global_rank}] reading trace from {self.trace_file}"
         )
-        self.readTrace(remotePath=self.trace_file)
+        # read the trace in the background while the backend is being initialized
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            traceFuture = executor.submit(self.loadTrace)
+            # only setup and perform collectives if not dry run mode
+            if not self.is_dry_run:
+                self.setBench(comms_world_info, commsParams, traceFuture=traceFuture)
+            traceFuture.result()
 
+    def loadTrace(self) -> None:
+        """
+        Read the trace of the current rank and do the first pass on it.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.readTrace(remotePath=self.trace_file)
         self.initTraceStat()
-        # only setup and perform collectives if not dry run mode
-        if not self.is_dry_run:
-            self.setBench(comms_world_info, commsParams)
+
+    def recordGroupRanks(self, commsParams: commsParamsHolderBase) -> None:
+        """
+        Record the process groups initialized in the trace into commsParams.groupRanks.
+
+        Args:
+            commsParams: Holds comms params to pass into backend for initialization.
+        Returns:
+            None
+        """
+        for curComm in self.comms_trace[: self.max_msg_cnt]:
+            # record process group info
+            if curComm.comms == "init":
+                commsParams.groupRanks[curComm.pgId] = curComm.groupRanks
 
     def setBench(
         self,
         comms_world_info: comms_world_info_holder,
         commsParams: commsParamsHolderBase,
+        traceFuture: Optional[Future] = None,
     ) -> None:
         """
         Initializes the replay backend.
@@ -1032,33 +1944,40 @@ class commsTraceReplayBench(paramCommsBench):
         Args:
             comms_world_info: Holds current environment information.
             commsParams: Holds comms params to pass into backend for initialization.
+            traceFuture: Future of loadTrace if the trace is still being read, it is waited for once the
+                         process groups of the trace are needed. If None, the trace must have been loaded already.
         Returns:
             None
         """
-        # init process groups
-        for curComm in self.comms_trace[: self.max_msg_cnt]:
-            # record process group info
-            if curComm.comms == "init":
-                commsParams.groupRanks[curComm.pgId] = curComm.groupRanks
-
         # init backend and corresponding function pointers
-        if commsParams.nw_stack == "pytorch-dist":
-            from pytorch_dist_backend import PyTorchDistBackend
-
-            self.backendFuncs = PyTorchDistBackend(comms_world_info, commsParams)
-        elif commsParams.nw_stack == "pytorch-xla-tpu":
-            from pytorch_tpu_backend import PyTorchTPUBackend
-
-            self.backendFuncs = PyTorchTPUBackend(comms_world_info, commsParams)
-        else:
+        if commsParams.nw_stack not in REPLAY_BACKENDS:
             logger.error("Unsopported NW stack! ")
             comms_utils.gracefulExit()
-
-        self.backendFuncs.initialize_backend(
-            comms_world_info.master_ip,
-            comms_world_info.master_port,
-            backend=commsParams.backend,
-        )
+        (moduleName, className) = REPLAY_BACKENDS[commsParams.nw_stack]
+        backendClass = getattr(importlib.import_module(moduleName), className)
+        self.backendFuncs = backendClass(comms_world_info, commsParams)
+
+        if traceFuture is not None and hasattr(self.backendFuncs, "initialize_groups"):
+            # the default process group does not depend on the trace, only create the groups of the trace
+            # after it is loaded
+            self.backendFuncs.initialize_backend(
+                comms_world_info.master_ip,
+                comms_world_info.master_port,
+                backend=commsParams.backend,
+                init_groups=False,
+            )
+            traceFuture.result()
+            self.recordGroupRanks(commsParams)
+            self.backendFuncs.initialize_groups(backend=commsParams.backend)
+        else:
+            if traceFuture is not None:
+                traceFuture.result()
+            self.recordGroupRanks(commsParams)
+            self.backendFuncs.initialize_backend(
+                comms_world_info.master_ip,
+                comms_world_info.master_port,
+                backend=commsParams.backend,
+            )
         self.backendFuncs.sayHello()
 
         # set basic collective info
@@ -1089,11 +2008,11 @@ class commsTraceReplayBench(paramCommsBench):
         self.collectiveArgs.opTensor = None
         self.collectiveArgs.quant_threshold = commsParams.quant_threshold
 
-        # set of collectives to be replayed
-        if self.allowList in ("all", "default", "*"):
-            self.allowList = self.backendFuncs.collectiveFunc.keys()
-        else:
-            self.allowList = [paramToCommName(op) for op in self.allowList.split(",")]
+        # set of collectives to be replayed, "all" means all the collectives supported by the backend
+        if isinstance(self.allowList, str):
+            self.allowList = parseAllowList(self.allowList)
+        if self.allowList is _ALL:
+            self.allowList = frozenset(self.backendFuncs.collectiveFunc)
 
     def initBench(
         self, commsParams: commsParamsHolderBase, args: argparse.Namespace
@@ -1112,12 +2031,16 @@ class commsTraceReplayBench(paramCommsBench):
         self.max_msg_cnt = args.max_msg_cnt
         self.is_blocking = args.z
         self.do_warm_up = args.do_warm_up
-        self.allowList = args.allow_ops
+        self.warmup_replays = args.warmup_replays
+        self.legacy_json = args.legacy_json
+        self.allowList = parseAllowList(args.allow_ops)
         self.out_path = args.output_path
         self.colls_per_batch = args.colls_per_batch
         self.use_timestamp = args.use_timestamp
         self.rebalance_policy = args.rebalance_policy.lower()
         self.num_replays = args.num_replays
+        self.inter_replay_barrier = args.inter_replay_barrier
+        self.event_timing = args.event_timing
 
         if commsParams.bitwidth < 32:
             comms_utils.initQuantCommCtx(self.collectiveArgs, commsParams)
@@ -1160,11 +2083,11 @@ class commsTraceReplayBench(paramCommsBench):
                 else:
                     raw_comms_trace = readFbRemoteTrace(remotePath=remotePath)
 
-            self.comms_trace = json.load(raw_comms_trace)
+            self.comms_trace = _loadJson(raw_comms_trace)
         else:
-            # read the json file from local disk
-            with open(self.trace_file) as f:
-                self.comms_trace = json.load(f)
+            # read the json file from local disk, in binary mode so orjson parses the bytes directly
+            with open(self.trace_file, "rb") as f:
+                self.comms_trace = _loadJson(f)
 
         # Convert trace to comms trace.
         try:
@@ -1185,24 +2108,21 @@ def extractCommsInfo(in_trace: List[Dict]) -> List[commsArgs]:
     # print("in extract comms info")
     # exit(1)
     newCommsTrace = []
+    paramToCommName = comms_utils.paramToCommName
     for cnt, curComm in enumerate(in_trace):
-        newComm = commsArgs()
-        newComm.comms = comms_utils.paramToCommName(curComm["comms"].lower())
-        newComm.seqnum = cnt
-        if "req" in curComm:
-            newComm.req = curComm["req"]
-        if "startTime_ns" in curComm:
-            newComm.startTimeNs = curComm["startTime_ns"]
-        if "markers" in curComm:
-            newComm.markerStack = curComm["markers"]
-        if "world_size" in curComm:
-            newComm.worldSize = curComm["world_size"]
-        if "root" in curComm:
-            newComm.root = curComm["root"]
-        if "pg_id" in curComm:
-            newComm.pgId = curComm["pg_id"]
-        if "global_ranks" in curComm:
-            newComm.groupRanks = curComm["global_ranks"]
+        # optional fields default to None, a single dict lookup per field
+        get = curComm.get
+        newComm = commsArgs(
+            comms=paramToCommName(curComm["comms"].lower()),
+            seqnum=cnt,
+            req=get("req"),
+            startTimeNs=get("startTime_ns"),
+            markerStack=get("markers"),
+            worldSize=get("world_size"),
+            root=get("root"),
+            pgId=get("pg_id"),
+            groupRanks=get("global_ranks"),
+        )
 
         if newComm.comms not in ("wait", "barrier", "init"):
             newComm.inMsgSize = curComm["in_msg_size"]
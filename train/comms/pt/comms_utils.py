@@ -11,6 +11,7 @@ from __future__ import (
     unicode_literals,
 )
 
+import functools
 import logging
 import os
 import random
@@ -18,7 +19,7 @@ import sys
 import time
 from abc import ABC, abstractmethod
 from argparse import ArgumentParser, Namespace
-from collections import OrderedDict
+from collections import deque, OrderedDict
 from contextlib import ContextDecorator
 from dataclasses import dataclass
 from io import StringIO
@@ -405,16 +406,15 @@ def clearQuantCommCtx(collectiveArgs: collectiveArgsHolder) -> None:
         pass
 
 
-def paramToCommName(name: str, supported_comms: List[str] = None) -> str:
+@functools.lru_cache(maxsize=64)
+def _mapCommName(name: str) -> str:
     """
-    Map any possible creative collective names to the internal name.
-    Validate the `name` if `supported_comms` is provided.
+    Map a collective name to the internal name, cached since a trace only has a few distinct names.
 
     Args:
         name: Name of collective.
-        supported_comms: List of supported comms to check in.
     Returns:
-        new_name: Returns the formatted name if supported_comms is empty, or name is in supported_comms.
+        new_name: Returns the internal name if name is a known alias, otherwise name itself.
     """
     name_aliases = {
         "alltoall": "all_to_all",
@@ -435,6 +435,22 @@ def paramToCommName(name: str, supported_comms: List[str] = None) -> str:
     else:
         new_name = name
 
+    return new_name
+
+
+def paramToCommName(name: str, supported_comms: List[str] = None) -> str:
+    """
+    Map any possible creative collective names to the internal name.
+    Validate the `name` if `supported_comms` is provided.
+
+    Args:
+        name: Name of collective.
+        supported_comms: List of supported comms to check in.
+    Returns:
+        new_name: Returns the formatted name if supported_comms is empty, or name is in supported_comms.
+    """
+    new_name = _mapCommName(name)
+
     if supported_comms is not None and new_name not in supported_comms:
         gracefulExit(
             f"{name} is not a supported communication in PARAM! Supported comms: {supported_comms}"
@@ -549,8 +565,29 @@ class commsArgs:
         markerStack: Current markers that this collective is a part of.
         root: Used to determine if collective is src or dst.
         eg_id: Node id in captured execution graph.
+        torchDtype: torch.dtype of dtype, resolved once when the trace is loaded.
     """
 
+    # one object per trace entry, slots avoid a per-object __dict__ and make unknown attributes an error
+    __slots__ = (
+        "comms",
+        "seqnum",
+        "req",
+        "inMsgSize",
+        "outMsgSize",
+        "dtype",
+        "inSplit",
+        "outSplit",
+        "startTimeNs",
+        "pgId",
+        "groupRanks",
+        "worldSize",
+        "markerStack",
+        "root",
+        "eg_id",
+        "torchDtype",
+    )
+
     def __init__(self, **kwargs) -> None:
         """
         Initialize arguments used for comm replay.
@@ -570,6 +607,7 @@ class commsArgs:
         self.markerStack = kwargs["markerStack"] if "markerStack" in kwargs else None
         self.root = kwargs["root"] if "root" in kwargs else None
         self.eg_id = kwargs["eg_id"] if "eg_id" in kwargs else None
+        self.torchDtype = kwargs["torchDtype"] if "torchDtype" in kwargs else None
 
     def toDict(self) -> Dict:
         """
@@ -604,39 +642,91 @@ class commsArgs:
 
         return commData
 
+    def __copy__(self) -> commsArgs:
+        """
+        Shallow copy of commsArgs, list fields are shared with the original.
+        """
+        newComm = commsArgs.__new__(commsArgs)
+        for field in commsArgs.__slots__:
+            setattr(newComm, field, getattr(self, field))
+        return newComm
+
+    def __deepcopy__(self, memo: Dict) -> commsArgs:
+        """
+        Copy of commsArgs, only the list fields need a new container since their items are immutable.
+        """
+        newComm = self.__copy__()
+        for field in ("inSplit", "outSplit", "markerStack", "groupRanks"):
+            value = getattr(self, field)
+            if value is not None:
+                setattr(newComm, field, list(value))
+        return newComm
+
+    def asDict(self) -> Dict:
+        """
+        All the fields of commsArgs by name, unlike toDict() the fields are not renamed or skipped.
+
+        Args:
+            None
+        Returns:
+            Dict: Field name to value, in the order of __slots__.
+        """
+        return {field: getattr(self, field) for field in commsArgs.__slots__}
+
     def __eq__(self, other: commsArgs) -> bool:
         """
         Used for testing. Check if two comms are equal.
         """
-        return self.__dict__ == other.__dict__
+        if not isinstance(other, commsArgs):
+            return NotImplemented
+        return self.asDict() == other.asDict()
 
     def __repr__(self):
         """
         Print repr of commsArgs in human readable format.
         """
-        return self.__dict__.__str__()
+        return self.asDict().__str__()
 
     def __str__(self) -> str:
         """
         Print out the commsArgs in human readable format.
         """
-        return self.__dict__.__str__()
+        return self.asDict().__str__()
 
 
 class paramProfile(record_function):
     """Inherit from PyTorch profiler to enable autoguard profiling while measuring the time interval in PARAM"""
 
-    def __init__(self, timer: paramTimer = None, description: str = "") -> None:
+    def __init__(
+        self, timer: paramTimer = None, description: str = "", fast: bool = False
+    ) -> None:
+        """
+        Args:
+            timer: Optional paramTimer that the measured interval is added to.
+            description: Name of the profiler range and the debug log.
+            fast: Only sample perf_counter_ns on enter and exit, without the profiler range and the debug log.
+                  Used on hot paths when the description would not be consumed, e.g., profiler is off.
+        """
         self.description = description
         self.timer = timer
+        self.fast = fast
         super().__init__(name=description)
 
     def __enter__(self) -> paramProfile:
+        if self.fast:
+            self.start = time.perf_counter_ns()
+            return self
         super().__enter__()
         self.start = time.monotonic()
         return self
 
     def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if self.fast:
+            self.end = time.perf_counter_ns()
+            self.intervalNS = self.end - self.start
+            if self.timer is not None:
+                self.timer.incrTimeNS(self.intervalNS)
+            return
         self.end = time.monotonic()
         self.intervalNS = (self.end - self.start) * 1e9  # keeping time in NS
         # if given a valid paramTimer object, directly update the measured time interval
@@ -905,6 +995,7 @@ class comms_world_info_holder:
     ) -> None:
         self.global_rank = comms_env_params["global_rank"]
         self.local_rank = comms_env_params["local_rank"]
+        self.local_size = comms_env_params["local_size"]
         self.world_size = comms_env_params["world_size"]
 
         self.master_ip = master_ip
@@ -925,11 +1016,15 @@ class commsParamsHolderBase:
         self.bitwidth = args.bitwidth
         self.quant_a2a_embedding_dim = args.quant_a2a_embedding_dim
         self.quant_threshold = args.quant_threshold
+        self.quant_cuda_graph = args.quant_cuda_graph
         self.dcheck = args.c
         self.groupRanks = (
             {}
         )  # record what ranks each process group will work on {pg_id, ranks}
         self.use_ext_dist = args.use_ext_dist
+        self.lazy_pg_init = args.lazy_pg_init
+        self.pin_cpus = args.pin_cpus
+        self.cpu_gloo_pg = args.cpu_gloo_pg
 
 
 class commsDlrmParamsHolder(commsParamsHolderBase):
@@ -1067,7 +1162,7 @@ class collectiveArgsHolder:
         self.asyncOp = -1
         self.dataSize = 0
         self.numElements = 0
-        self.waitObj = []
+        self.waitObj = deque()  # outstanding ops, completed from the front
         self.waitObjIds = {}  # mapping of reqID to future of async collectives
 
         self.ipTensor_split_pair = []
@@ -1243,12 +1338,12 @@ class paramCommsBench(ABC):
         self.collectiveArgs.opTensor_split = (
             curComm.outSplit
             if (curComm.outSplit is not None)
-            else [(numElementsOut // world_size) for _ in range(world_size)]
+            else [numElementsOut // world_size] * world_size
         )
         self.collectiveArgs.ipTensor_split = (
             curComm.inSplit
             if (curComm.inSplit is not None)
-            else [(numElementsIn // world_size) for _ in range(world_size)]
+            else [numElementsIn // world_size] * world_size
         )
         return (ipTensor, opTensor)
 
@@ -1674,6 +1769,12 @@ class paramCommsBench(ABC):
             default=33554432,
             help="threshold of message sizes to perform quantization if enabled",
         )  # quantization threshold, default 32 MB
+        parser.add_argument(
+            "--quant-cuda-graph",
+            action="store_true",
+            default=False,
+            help="Replay blocking quantized all_reduce on CUDA from a CUDA graph captured per message shape",
+        )  # capture quantize -> all_reduce -> de-quantize in a CUDA graph
         parser.add_argument(
             "--c",
             type=int,
@@ -1688,6 +1789,24 @@ class paramCommsBench(ABC):
             default=False,
             help="use extend_distributed wrapper",
         )  # use extend_distributed wrapper to init and create PGs
+        parser.add_argument(
+            "--lazy-pg-init",
+            action="store_true",
+            default=False,
+            help="Connect the ranks of a gloo process group on its first collective instead of at creation",
+        )  # PGs that are never used do not pay for their connections
+        parser.add_argument(
+            "--pin-cpus",
+            action="store_true",
+            default=False,
+            help="Pin each rank to its share of the CPUs of the host, unless the launcher already bound it",
+        )  # the CPU threads of the ranks on a host do not compete for cores
+        parser.add_argument(
+            "--cpu-gloo-pg",
+            action="store_true",
+            default=False,
+            help="Add gloo to the NCCL default process group for collectives on CPU tensors, e.g., object collectives. Connects a gloo mesh of all ranks at init, and a barrier of the default group may run on gloo if no device is bound to it",
+        )  # host tensors of the control collectives do not take a round trip through the GPU
         pass
 
     @abstractmethod
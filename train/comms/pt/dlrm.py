@@ -1358,7 +1358,7 @@ class commsDLRMBench(paramCommsBench):
             global_rank, world_size, args
         )  # supports reading model parameters from json file, or from opensource DLRM CLI format.
         self.collectiveArgs.device = curDevice
-        self.collectiveArgs.waitObj = []
+        self.collectiveArgs.waitObj.clear()
         self.collectiveArgs.group = group
         self.comm_size = world_size
         self.my_rank = global_rank
@@ -3,12 +3,16 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import inspect
 import logging
 import os
+import time
+from datetime import timedelta
 from itertools import cycle
+from operator import attrgetter
+from types import SimpleNamespace
 from typing import List, Optional
 
-import numpy as np
 import torch
 import torch.distributed as dist
 import torch.nn as nn
@@ -27,18 +31,191 @@ except ImportError:
     except ImportError:
         has_ext_dist = False
 
+try:
+    import redis
+
+    has_redis = True
+except ImportError:
+    has_redis = False
+
 logger = logging.getLogger(__name__)
 
+# None if torch does not have the float8 dtypes yet
+_FP8_E4M3 = getattr(torch, "float8_e4m3fn", None)
+# largest finite value of float8_e4m3fn
+_FP8_E4M3_MAX = 448.0
+# how long the ranks wait for each other at teardown before the groups are aborted
+_TEARDOWN_TIMEOUT = timedelta(seconds=30)
+# rendezvous of the default group, slow at large scale
+_INIT_PG_TIMEOUT = timedelta(seconds=1800)
+# True if init_process_group can bind the default group to a device (torch >= 2.3)
+_INIT_PG_DEVICE_ID = (
+    "device_id" in inspect.signature(dist.init_process_group).parameters
+)
+
+
+class RedisStore(dist.Store):
+    """
+    c10d store on a Redis server, for the rendezvous of very large jobs where the single
+    TCPStore server of rank 0 becomes the bottleneck. Keys are namespaced by a prefix,
+    which has to be unique per run, as Redis keeps the keys of previous runs until they
+    expire.
+
+    Args:
+        host: Address of the Redis server.
+        port: Port of the Redis server.
+        prefix: Prefix of all keys of the store.
+        timeout: Default timeout of get() and wait().
+        expire: Seconds after which the keys are dropped by the server.
+    """
+
+    # Lua script of compare_set: set to desired if the key holds expected, or if the key
+    # is missing and expected is empty, then return the value of the key
+    _COMPARE_SET = """
+    local cur = redis.call('GET', KEYS[1])
+    if (not cur and ARGV[1] == '') or cur == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+        return ARGV[2]
+    end
+    if not cur then
+        return ARGV[1]
+    end
+    return cur
+    """
+
+    def __init__(self, host, port, prefix, timeout=timedelta(minutes=30), expire=86400):
+        super().__init__()
+        self.client = redis.Redis(host=host, port=port)
+        self.prefix = prefix
+        self.expire = expire
+        self.set_timeout(timeout)
+        self.compareSet = self.client.register_script(self._COMPARE_SET)
+
+    def set_timeout(self, timeout):
+        self.storeTimeout = timeout
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def set(self, key, value):
+        self.client.set(self._key(key), value, ex=self.expire)
+
+    def get(self, key):
+        self.wait([key])
+        return self.client.get(self._key(key))
+
+    def add(self, key, amount):
+        pipe = self.client.pipeline()
+        pipe.incrby(self._key(key), amount)
+        pipe.expire(self._key(key), self.expire)
+        return pipe.execute()[0]
+
+    def compare_set(self, key, expected_value, desired_value):
+        return self.compareSet(
+            keys=[self._key(key)], args=[expected_value, desired_value, self.expire]
+        )
+
+    def check(self, keys):
+        return self.client.exists(*[self._key(key) for key in keys]) == len(keys)
+
+    def wait(self, keys, timeout=None):
+        timeout = self.storeTimeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout.total_seconds()
+        # poll with backoff, the connected ranks arrive at different times
+        delay = 0.001
+        while not self.check(keys):
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Timed out waiting for keys {keys} in RedisStore")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.1)
+
+    def delete_key(self, key):
+        return self.client.delete(self._key(key)) > 0
 
-def _downcast(input, bitwidth):
+    def num_keys(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+def _downcast(input, bitwidth, out=None, op=dist.ReduceOp.SUM):
+    # out is an optional float16 buffer to cast into for bitwidth 16
     if bitwidth == 16:
+        if out is not None:
+            return out.copy_(input)
         return input.to(torch.float16)
     elif bitwidth == 8:
-        return input.to(torch.int8)
+        # FP8 is reduced by fp8_all_reduce(), which only sums
+        if _FP8_E4M3 is None or op != dist.ReduceOp.SUM:
+            return input.to(torch.int8)
+        return _fp8_quantize(input)
     else:
         raise NotImplementedError("Unsupported bitwidth. Set --bitwidth to 8/16/32")
 
 
+def _fp8_quantize(input):
+    # per-tensor scale so that the largest magnitude maps to the largest FP8 E4M3 value,
+    # clamped to not divide by zero for an all-zero tensor
+    scale = (input.abs().amax().float() / _FP8_E4M3_MAX).clamp_(
+        min=torch.finfo(torch.float32).tiny
+    )
+    quantized = (input / scale).to(_FP8_E4M3)
+    quantized._param_fp8_scale = scale
+    return quantized
+
+
+def _is_fp8(tensor):
+    return _FP8_E4M3 is not None and tensor.dtype == _FP8_E4M3
+
+
+def _scale_to_float(quantized, scale):
+    return quantized.to(torch.float32) * scale
+
+
+# torch.compile of _scale_to_float to fuse the cast and the scaling into one kernel on CUDA,
+# compiled on first use since torch.compile takes seconds to set up, False if it is not available or failed
+_fused_scale_to_float = None
+
+
+def _fp8_dequantize(quantized, scale):
+    global _fused_scale_to_float
+    if quantized.is_cuda and _fused_scale_to_float is not False:
+        try:
+            if _fused_scale_to_float is None:
+                _fused_scale_to_float = torch.compile(
+                    _scale_to_float, dynamic=True, fullgraph=True
+                )
+            return _fused_scale_to_float(quantized, scale)
+        except Exception as err:
+            logger.warning(
+                f"Fused FP8 de-quantization failed, using eager de-quantization: {err}"
+            )
+            _fused_scale_to_float = False
+    return _scale_to_float(quantized, scale)
+
+
+# reduce ops by name of get_reduce_op()
+_REDUCE_OPS = {"sum": dist.ReduceOp.SUM, "max": dist.ReduceOp.MAX}
+
+# bytes per element by dtype, filled on first use
+_DTYPE_BYTES = {}
+
+
+def _sum_tensor_bytes(tensors):
+    # total bytes of a tensor or a list of tensors, the tensors of a list all have the same dtype
+    if isinstance(tensors, list):
+        if len(tensors) == 0:
+            return 0
+        dtype = tensors[0].dtype
+        # map() calls numel() from C, without a python frame per tensor
+        numel = sum(map(torch.Tensor.numel, tensors))
+    else:
+        dtype = tensors.dtype
+        numel = tensors.numel()
+    elemBytes = _DTYPE_BYTES.get(dtype)
+    if elemBytes is None:
+        elemBytes = _DTYPE_BYTES[dtype] = torch.empty((), dtype=dtype).element_size()
+    return numel * elemBytes
+
+
 # a future object or a tensor
 # okay to use float32 because a prior check that ensures
 # the original dtype is float32.
@@ -47,6 +224,8 @@ def _dequantize(obj):
         # invoked in a irrelevant rank
         return None
     elif type(obj) == torch.Tensor:
+        if _is_fp8(obj):
+            return _fp8_dequantize(obj, obj._param_fp8_scale)
         # only call to() if it is not a float32 tensor
         if obj.dtype != torch.float32:
             return obj.to(torch.float32)
@@ -89,15 +268,181 @@ class PyTorchDistBackend(backendFunctions):
             if global_rank == 0:
                 print(all_hello_msgs)
 
+    def fp8_all_reduce(self, collectiveArgs, quantized):
+        """
+        SUM all-reduce of a FP8 tensor from _downcast(). Each rank has its own scale and the
+        backends do not reduce FP8, so it is done in two steps that only send FP8 bytes and one scale per rank:
+        1) reduce-scatter: each rank receives its chunk from all the ranks by all_to_all, and sums the dequantized chunks,
+        2) all-gather: the summed chunks are quantized again and gathered by all the ranks.
+
+        Args:
+            collectiveArgs: Holds the group and asyncOp of the collective.
+            quantized: FP8 tensor from _downcast().
+        Returns:
+            (work, dequantize): Work of the last step (None if not asyncOp), and the function that returns the
+                                reduced float32 tensor once the work is completed.
+        """
+        group = self.get_collective_group(collectiveArgs)
+        world_size = dist.get_world_size(group)
+        numel = quantized.numel()
+        chunk = -(-numel // world_size)
+        payload = quantized.reshape(-1).view(torch.uint8)
+        if chunk * world_size != numel:
+            payload = nn.functional.pad(payload, (0, chunk * world_size - numel))
+
+        scales = torch.empty(world_size, dtype=torch.float32, device=quantized.device)
+        dist.all_gather_into_tensor(
+            scales, quantized._param_fp8_scale.reshape(1), group=group
+        )
+        received = torch.empty_like(payload)
+        dist.all_to_all_single(received, payload, group=group)
+        shard = _fp8_dequantize(
+            received.view(_FP8_E4M3).view(world_size, chunk), scales.unsqueeze(1)
+        ).sum(0)
+
+        shardQuantized = _fp8_quantize(shard)
+        dist.all_gather_into_tensor(
+            scales, shardQuantized._param_fp8_scale.reshape(1), group=group
+        )
+        gathered = torch.empty_like(payload)
+        work = dist.all_gather_into_tensor(
+            gathered,
+            shardQuantized.view(torch.uint8),
+            group=group,
+            async_op=collectiveArgs.asyncOp,
+        )
+
+        def dequantize(fut=None):
+            result = _fp8_dequantize(
+                gathered.view(_FP8_E4M3).view(world_size, chunk), scales.unsqueeze(1)
+            ).view(-1)
+            return result[:numel].view(quantized.shape)
+
+        return (work, dequantize)
+
+    def _quant_all_reduce(self, collectiveArgs, tensor):
+        # blocking quantize -> all_reduce -> dequantize of tensor, captured by graph_quant_all_reduce()
+        quantized = _downcast(
+            tensor, collectiveArgs.allreduce_qcomm, op=collectiveArgs.op
+        )
+        if _is_fp8(quantized):
+            return self.fp8_all_reduce(collectiveArgs, quantized)[1]()
+        if self.use_ext_dist:
+            collectiveArgs.group.all_reduce(
+                tensor=quantized, op=collectiveArgs.op, async_op=False
+            )
+        else:
+            dist.all_reduce(quantized, op=collectiveArgs.op, group=collectiveArgs.group)
+        return _dequantize(quantized)
+
+    def graph_quant_all_reduce(self, collectiveArgs):
+        """
+        Blocking quantized all_reduce of collectiveArgs.ipTensor replayed from a CUDA graph, so that the
+        quantization, the all_reduce and the de-quantization are launched at once.
+        A graph is captured the first time a shape, dtype, bitwidth and group is seen.
+
+        Args:
+            collectiveArgs: Holds the input tensor and the collective context.
+        Returns:
+            Tensor: De-quantized result, it is the static output of the graph and is overwritten by the next replay.
+        """
+        ipTensor = collectiveArgs.ipTensor
+        key = (
+            tuple(ipTensor.shape),
+            ipTensor.dtype,
+            collectiveArgs.allreduce_qcomm,
+            id(collectiveArgs.group),
+        )
+        cached = self._graph_cache.get(key)
+        if cached is None:
+            staticIn = ipTensor.clone()
+            # warm up on a side stream before the capture, as required by CUDA graphs
+            sideStream = torch.cuda.Stream()
+            sideStream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(sideStream):
+                for _ in range(3):
+                    self._quant_all_reduce(collectiveArgs, staticIn)
+            torch.cuda.current_stream().wait_stream(sideStream)
+            graph = torch.cuda.CUDAGraph()
+            with torch.cuda.graph(graph):
+                staticOut = self._quant_all_reduce(collectiveArgs, staticIn)
+            cached = (graph, staticIn, staticOut)
+            self._graph_cache[key] = cached
+        (graph, staticIn, staticOut) = cached
+        staticIn.copy_(ipTensor)
+        graph.replay()
+        return staticOut
+
+    def quant_buffer(self, collectiveArgs):
+        """
+        Pooled float16 buffer, by shape and device, that a blocking 16-bit quantized all_reduce/reduce
+        casts collectiveArgs.ipTensor into instead of allocating a new tensor every call.
+
+        Args:
+            collectiveArgs: Holds the input tensor, bitwidth and asyncOp of the collective.
+        Returns:
+            Tensor: Buffer for _downcast(), or None if the collective is non-blocking or not 16-bit.
+        """
+        # the ops of a non-blocking collective may still use the buffer when the next one is posted
+        if collectiveArgs.asyncOp or collectiveArgs.allreduce_qcomm != 16:
+            return None
+        ipTensor = collectiveArgs.ipTensor
+        key = (tuple(ipTensor.shape), ipTensor.device)
+        buffer = self._quant_pool.get(key)
+        if buffer is None:
+            buffer = torch.empty_like(ipTensor, dtype=torch.float16)
+            self._quant_pool[key] = buffer
+        elif self._dequant_pending:
+            # dequantize_blocking() of the previous collective may still be reading the buffer
+            torch.cuda.current_stream().wait_event(self._dequant_event)
+        return buffer
+
+    def dequantize_blocking(self, quantized):
+        """
+        De-quantize the result of a blocking quantized all_reduce/reduce. On CUDA it runs on a side stream,
+        so that the work queued next on the current stream does not wait for it, and the current stream
+        waits for it in complete_accel_ops().
+
+        Args:
+            quantized: Quantized tensor that holds the result of the collective.
+        Returns:
+            Tensor: De-quantized result, only ready for the current stream after complete_accel_ops().
+        """
+        if not quantized.is_cuda:
+            return _dequantize(quantized)
+        if self._dequant_stream is None:
+            self._dequant_stream = self.get_new_stream()
+        # the blocking collective is ordered before the work queued next on the current stream
+        self._dequant_stream.wait_stream(torch.cuda.current_stream(quantized.device))
+        with torch.cuda.stream(self._dequant_stream):
+            result = _dequantize(quantized)
+            self._dequant_event.record()
+        # the caller drops quantized, keep its memory until the side stream is done with it
+        quantized.record_stream(self._dequant_stream)
+        self._dequant_pending = True
+        return result
+
     # Collectives
     def all_reduce(self, collectiveArgs, retFlag=False, pair=False):
         # pair=True mode does not support quantization
-        if (
+        quantize = (
             collectiveArgs.allreduce_qcomm != 32
             and collectiveArgs.allreduce_qcomm > 4
             and collectiveArgs.ipTensor.dtype == torch.float32
             and not pair
+        )
+        if (
+            quantize
+            and self.quant_cuda_graph
+            and not collectiveArgs.asyncOp
+            and collectiveArgs.ipTensor.is_cuda
         ):
+            # the quantization time is part of the graph and is not reported separately
+            retObj = self.graph_quant_all_reduce(collectiveArgs)
+            if retFlag:
+                return retObj
+            return
+        if quantize:
             # note: note that quantized is a new tensor
             # that is not collectiveArgs.ipTensor.
             # this means when all_reduce/reduce finished
@@ -111,12 +456,19 @@ class PyTorchDistBackend(backendFunctions):
                 description="# PARAM: Allreduce quantization #",
             ):
                 quantized = _downcast(
-                    collectiveArgs.ipTensor, collectiveArgs.allreduce_qcomm
+                    collectiveArgs.ipTensor,
+                    collectiveArgs.allreduce_qcomm,
+                    out=self.quant_buffer(collectiveArgs),
+                    op=collectiveArgs.op,
                 )
         else:
             quantized = (
                 collectiveArgs.ipTensor if not pair else collectiveArgs.ipTensor_pair
             )
+        if _is_fp8(quantized):
+            return self._fp8_reduce_collective(
+                collectiveArgs, quantized, retFlag, "Allreduce"
+            )
         if self.use_ext_dist:
             retObj = collectiveArgs.group.all_reduce(
                 tensor=quantized,
@@ -138,10 +490,25 @@ class PyTorchDistBackend(backendFunctions):
                     timer=collectiveArgs.dequant_time,
                     description="# PARAM: Allreduce de-quantization #",
                 ):
-                    retObj = _dequantize(quantized)
+                    retObj = self.dequantize_blocking(quantized)
+
+        if collectiveArgs.asyncOp:
+            collectiveArgs.waitObj.append(retObj)
+
+        if retFlag:
+            return retObj
 
+    def _fp8_reduce_collective(self, collectiveArgs, quantized, retFlag, name):
+        (retObj, dequantize) = self.fp8_all_reduce(collectiveArgs, quantized)
         if collectiveArgs.asyncOp:
+            retObj = retObj.get_future().then(dequantize)
             collectiveArgs.waitObj.append(retObj)
+        else:
+            with paramProfile(
+                timer=collectiveArgs.dequant_time,
+                description=f"# PARAM: {name} de-quantization #",
+            ):
+                retObj = dequantize()
 
         if retFlag:
             return retObj
@@ -155,12 +522,20 @@ class PyTorchDistBackend(backendFunctions):
                 description="# PARAM: Reduce quantization #",
             ):
                 quantized = _downcast(
-                    collectiveArgs.ipTensor, collectiveArgs.allreduce_qcomm
+                    collectiveArgs.ipTensor,
+                    collectiveArgs.allreduce_qcomm,
+                    out=self.quant_buffer(collectiveArgs),
+                    op=collectiveArgs.op,
                 )
         else:
             quantized = (
                 collectiveArgs.ipTensor if not pair else collectiveArgs.ipTensor_pair
             )
+        if _is_fp8(quantized):
+            # the FP8 result is reduced on all the ranks, dst included
+            return self._fp8_reduce_collective(
+                collectiveArgs, quantized, retFlag, "Reduce"
+            )
 
         retObj = dist.reduce(
             quantized,
@@ -177,7 +552,7 @@ class PyTorchDistBackend(backendFunctions):
                     timer=collectiveArgs.dequant_time,
                     description="# PARAM: Reduce de-quantization #",
                 ):
-                    retObj = _dequantize(quantized)
+                    retObj = self.dequantize_blocking(quantized)
 
         if collectiveArgs.asyncOp:
             collectiveArgs.waitObj.append(retObj)
@@ -198,9 +573,11 @@ class PyTorchDistBackend(backendFunctions):
                 collectiveArgs.num_emb_tables_batched * collectiveArgs.emb_dim
             ] * collectiveArgs.world_size
 
+            # the alltoall of a lookup is posted before the next lookup runs, so the lookups overlap
+            # the alltoalls in flight
             for i in range(collectiveArgs.num_emb_ops):
                 pooled_embs = collectiveArgs.emb[i](*collectiveArgs.embRequests[i])
-                work += [
+                work.append(
                     collectiveArgs.group.alltoall_pooled(
                         pooled_embs.reshape(
                             collectiveArgs.batch_size,
@@ -209,7 +586,7 @@ class PyTorchDistBackend(backendFunctions):
                         ),
                         dim_sum_per_rank,
                     )
-                ]
+                )
 
             for r in work:
                 r.wait()
@@ -353,8 +730,60 @@ class PyTorchDistBackend(backendFunctions):
         if retFlag:
             return retObj
 
+    def stacked_reduce_scatter_input(self, collectiveArgs):
+        """
+        Copy the input list of a blocking reduce_scatter into one pooled contiguous buffer,
+        so it is posted as reduce_scatter_tensor instead of letting the process group
+        allocate and fill a flat copy of the list on every call.
+
+        Args:
+            collectiveArgs: Holds the input list and asyncOp of the collective.
+        Returns:
+            Tensor: Concatenated input list, or None if the fast path does not apply.
+        """
+        # a non-blocking collective may still read the buffer when the next one is posted
+        if collectiveArgs.asyncOp or not isinstance(collectiveArgs.ipTensor, list):
+            return None
+        inputList = collectiveArgs.ipTensor
+        if len(inputList) == 0 or inputList[0].dim() == 0:
+            return None
+        first = inputList[0]
+        if any(
+            t.shape != first.shape or t.dtype != first.dtype or t.device != first.device
+            for t in inputList
+        ):
+            return None
+        key = (len(inputList), tuple(first.shape), first.dtype, first.device)
+        scratch = self._rs_scratch.get(key)
+        if scratch is None:
+            # concatenated along dim 0, the layout reduce_scatter_tensor expects
+            scratch = torch.empty(
+                (len(inputList) * first.shape[0],) + tuple(first.shape[1:]),
+                dtype=first.dtype,
+                device=first.device,
+            )
+            self._rs_scratch[key] = scratch
+        chunks = list(scratch.chunk(len(inputList)))
+        if hasattr(torch, "_foreach_copy_"):
+            torch._foreach_copy_(chunks, inputList)
+        else:
+            for chunk, t in zip(chunks, inputList):
+                chunk.copy_(t)
+        return scratch
+
     def reduce_scatter(self, collectiveArgs, retFlag=False, pair=False):
-        if self.use_ext_dist:
+        stackedInput = None
+        if not self.use_ext_dist:
+            stackedInput = self.stacked_reduce_scatter_input(collectiveArgs)
+        if stackedInput is not None:
+            retObj = dist.reduce_scatter_tensor(
+                output=collectiveArgs.opTensor,
+                input=stackedInput,
+                op=collectiveArgs.op,
+                group=collectiveArgs.group,
+                async_op=False,
+            )
+        elif self.use_ext_dist:
             retObj = collectiveArgs.group.reduce_scatter(
                 output=collectiveArgs.opTensor,
                 input_list=collectiveArgs.ipTensor,
@@ -409,14 +838,13 @@ class PyTorchDistBackend(backendFunctions):
     def incast(self, collectiveArgs):
         if collectiveArgs.global_rank == collectiveArgs.srcOrDst:
             # root receives tensor from each of user-specified source ranks
-            for idx, src_rank in enumerate(collectiveArgs.src_ranks):
-                retObj = dist.irecv(
-                    tensor=collectiveArgs.opTensor[idx],
-                    src=src_rank,
-                    group=self.get_collective_group(collectiveArgs),
-                    tag=0,
-                )
-                collectiveArgs.waitObj.append(retObj)
+            self.root_p2p(
+                collectiveArgs,
+                [
+                    (dist.irecv, collectiveArgs.opTensor[idx], src_rank)
+                    for idx, src_rank in enumerate(collectiveArgs.src_ranks)
+                ],
+            )
             # complete outstanding irecvs if blocking
             if not collectiveArgs.asyncOp:
                 self.complete_accel_ops(collectiveArgs, devSync=False)
@@ -447,8 +875,13 @@ class PyTorchDistBackend(backendFunctions):
     def multicast(self, collectiveArgs):
         if collectiveArgs.global_rank == collectiveArgs.srcOrDst:
             # root sends tensor to each of user-specified destination ranks
-            for dst_rank in collectiveArgs.dst_ranks:
-                self.isend(collectiveArgs, dst_rank)
+            self.root_p2p(
+                collectiveArgs,
+                [
+                    (dist.isend, collectiveArgs.ipTensor, dst_rank)
+                    for dst_rank in collectiveArgs.dst_ranks
+                ],
+            )
             # complete outstanding isends if blocking
             if not collectiveArgs.asyncOp:
                 self.complete_accel_ops(collectiveArgs, devSync=False)
@@ -459,6 +892,27 @@ class PyTorchDistBackend(backendFunctions):
             else:
                 self.recv(collectiveArgs, collectiveArgs.srcOrDst)
 
+    def root_p2p(self, collectiveArgs, p2pOps):
+        """
+        Post the p2p ops of the root rank of incast/multicast in one batch_isend_irecv() call,
+        NCCL runs them as one group call.
+
+        Args:
+            collectiveArgs: Holds the group and the outstanding ops.
+            p2pOps: List of (dist.isend or dist.irecv, tensor, peer rank).
+        Returns:
+            None
+        """
+        group = self.get_collective_group(collectiveArgs)
+        collectiveArgs.waitObj.extend(
+            dist.batch_isend_irecv(
+                [
+                    dist.P2POp(p2pFunc, tensor, peer, group=group, tag=0)
+                    for (p2pFunc, tensor, peer) in p2pOps
+                ]
+            )
+        )
+
     def send(self, collectiveArgs, dst_rank, retFlag=False, tag=0):
         dist.send(
             tensor=collectiveArgs.ipTensor,
@@ -502,23 +956,28 @@ class PyTorchDistBackend(backendFunctions):
             return retObj
 
     def device_sync(self, collectiveArgs):
-        dev_str = (
-            self.commsParams["device"]
-            if isinstance(self.commsParams, dict)
-            else self.commsParams.device
-        )
-        if dev_str == "cuda":
+        if self._dev_str == "cuda":
             torch.cuda.synchronize(collectiveArgs.device)
 
     def complete_accel_ops(self, collectiveArgs, initOp=False, devSync=True):
         if initOp is True:
-            temp = torch.ones([1], device=collectiveArgs.device)
-            dist.all_reduce(temp)
+            # reuse the 1-element tensor of the init all_reduce, zeros so its value does not grow across calls
+            if (
+                self._init_op_tensor is None
+                or self._init_op_device != collectiveArgs.device
+            ):
+                self._init_op_tensor = torch.zeros([1], device=collectiveArgs.device)
+                self._init_op_device = collectiveArgs.device
+            dist.all_reduce(self._init_op_tensor)
         for waitReq in collectiveArgs.waitObj:
             if waitReq is not None:
                 waitReq.wait()
         collectiveArgs.waitObj.clear()
         collectiveArgs.waitObjIds.clear()
+        if self._dequant_pending:
+            # the events of dequantize_blocking() are in order on the side stream, waiting on the last one is enough
+            torch.cuda.current_stream().wait_event(self._dequant_event)
+            self._dequant_pending = False
 
         if devSync:
             self.device_sync(collectiveArgs)
@@ -527,7 +986,7 @@ class PyTorchDistBackend(backendFunctions):
     def complete_single_op(self, collectiveArgs, retFlag=False):
         """only wait on the first op in the queue"""
         if len(collectiveArgs.waitObj) > 0:
-            waitReq = collectiveArgs.waitObj.pop(0)
+            waitReq = collectiveArgs.waitObj.popleft()
             if waitReq is not None:
                 waitReq.wait()
 
@@ -564,12 +1023,8 @@ class PyTorchDistBackend(backendFunctions):
         self.complete_accel_ops(collectiveArgs)
 
     def get_reduce_op(self, opName):
-        if opName == "sum":
-            return dist.ReduceOp.SUM
-        elif opName == "max":
-            return dist.ReduceOp.MAX
-        else:
-            return dist.ReduceOp.SUM
+        # unknown ops fall back to sum
+        return _REDUCE_OPS.get(opName, dist.ReduceOp.SUM)
 
     # Compute functions
     def compute_mm(self, collectiveArgs):
@@ -598,43 +1053,19 @@ class PyTorchDistBackend(backendFunctions):
 
     # Memory related
     def get_mem_size(self, collectiveArgs, pair=False):
-        _sizeBytes = 0
+        if pair:
+            return _sum_tensor_bytes(collectiveArgs.opTensor_pair)
         # opTensor could be a list of tensor for all_gather/gather/incast, get the aggregated size
         if isinstance(collectiveArgs.opTensor, list):
-            _sizeBytes = sum(
-                [t.nelement() * t.element_size() for t in collectiveArgs.opTensor]
-            )
+            return _sum_tensor_bytes(collectiveArgs.opTensor)
         # reduce scatter
         elif isinstance(collectiveArgs.ipTensor, list):
-            _sizeBytes = sum(
-                [t.nelement() * t.element_size() for t in collectiveArgs.ipTensor]
-            )
+            return _sum_tensor_bytes(collectiveArgs.ipTensor)
         # reduce_scatter_base and reduce_scatter_v should use input tensor for total memory size
         elif collectiveArgs.collective in ["reduce_scatter_v", "reduce_scatter_base"]:
-            _sizeBytes = (
-                collectiveArgs.ipTensor.nelement()
-                * collectiveArgs.ipTensor.element_size()
-            )
+            return _sum_tensor_bytes(collectiveArgs.ipTensor)
         else:
-            _sizeBytes = (
-                collectiveArgs.opTensor.nelement()
-                * collectiveArgs.opTensor.element_size()
-            )
-        if pair:
-            if isinstance(collectiveArgs.opTensor_pair, list):
-                _sizeBytes = sum(
-                    [
-                        t.nelement() * t.element_size()
-                        for t in collectiveArgs.opTensor_pair
-                    ]
-                )
-            else:
-                _sizeBytes = (
-                    collectiveArgs.opTensor_pair.nelement()
-                    * collectiveArgs.opTensor_pair.element_size()
-                )
-
-        return _sizeBytes
+            return _sum_tensor_bytes(collectiveArgs.opTensor)
 
     def alloc_random(
         self, sizeArr, curRankDevice="cuda", dtype=torch.float32, scaleFactor=1.0
@@ -644,8 +1075,9 @@ class PyTorchDistBackend(backendFunctions):
                 low=0, high=10, size=sizeArr, device=curRankDevice, dtype=dtype
             )
         elif dtype == torch.bool:
-            ipTensor = (
-                torch.rand(sizeArr, device=curRankDevice, dtype=torch.float32) < 0.5
+            # draw 0/1 directly into the bool tensor, instead of comparing a float32 tensor 4x its size
+            ipTensor = torch.empty(sizeArr, device=curRankDevice, dtype=dtype).random_(
+                0, 2
             )
         else:
             ipTensor = torch.rand(sizeArr, device=curRankDevice, dtype=dtype)
@@ -654,16 +1086,13 @@ class PyTorchDistBackend(backendFunctions):
         return ipTensor
 
     def alloc_embedding_tables(self, n, m, curRankDevice, dtype):
-        EE = nn.EmbeddingBag(n, m, mode="sum", sparse=True)
-
-        W = np.random.uniform(
-            low=-(np.sqrt(1 / n)), high=np.sqrt(1 / n), size=(n, m)
-        ).astype(np.float32)
-        # approach 1
-
-        EE.weight.data = torch.tensor(
-            W, dtype=dtype, requires_grad=True, device=curRankDevice
+        # init the weights on the device, instead of on the host and copying them over
+        bound = (1 / n) ** 0.5
+        W = torch.empty((n, m), dtype=dtype, device=curRankDevice).uniform_(
+            -bound, bound
         )
+        # passing the weights also skips the default init of a host (n, m) table by EmbeddingBag
+        EE = nn.EmbeddingBag(n, m, mode="sum", sparse=True, _weight=W)
         return EE
 
     def alloc_empty(self, sizeArr, dtype, curRankDevice):
@@ -675,6 +1104,12 @@ class PyTorchDistBackend(backendFunctions):
         if collectiveArgs.ipTensor_pair is not None:
             del collectiveArgs.ipTensor_pair
             del collectiveArgs.opTensor_pair
+        # buffers of the previous message size are not reused by the next one
+        self._rs_scratch.clear()
+        # a pending de-quantization keeps its buffer alive through record_stream()
+        self._quant_pool.clear()
+        # captured graphs hold their private memory pool and static tensors
+        self._graph_cache.clear()
 
         torch.cuda.empty_cache()
 
@@ -689,16 +1124,17 @@ class PyTorchDistBackend(backendFunctions):
         return self.comms_world_info.world_size
 
     def get_group_rank(self, group):
+        # the local process is not a member of groups recorded as None
+        if group is None:
+            return -1
         return dist.get_rank(group)
 
     def get_device(self):
         """get current device: 'cpu' or 'cuda'"""
-        # TODO: this is a temporary workaround; need to unify the type of commsParams in comms and dlrm
-        dev_str = (
-            self.commsParams["device"]
-            if isinstance(self.commsParams, dict)
-            else self.commsParams.device
-        )
+        # the device and local rank do not change, so the device is only built on the first call
+        if self._device is not None:
+            return self._device
+        dev_str = self._dev_str
         my_dev = torch.device(dev_str)
         if dev_str == "cuda":
             # explicitly select the device ordinal based on the local rank
@@ -713,6 +1149,7 @@ class PyTorchDistBackend(backendFunctions):
             # sanity check, such error should be catched when parsing arguments
             raise ValueError(f"{dev_str} is not a valid device option")
 
+        self._device = my_dev
         return my_dev
 
     def get_hw_device(self):
@@ -736,11 +1173,7 @@ class PyTorchDistBackend(backendFunctions):
 
     def set_device(self):
         """set current device: 'cpu' or 'cuda'"""
-        dev_str = (
-            self.commsParams["device"]
-            if isinstance(self.commsParams, dict)
-            else self.commsParams.device
-        )
+        dev_str = self._dev_str
         if dev_str.startswith("cuda"):
             if self.get_local_rank() > torch.cuda.device_count():
                 raise ValueError(
@@ -752,9 +1185,57 @@ class PyTorchDistBackend(backendFunctions):
 
         logger.info(f"rank {self.get_global_rank()} set torch device to {dev_str}")
 
+    def pin_cpu_affinity(self):
+        """
+        Pin the process to an even, contiguous share of the CPUs of the host by local
+        rank, and size the intra-op thread pool to it, so the gloo and compute threads
+        of the ranks on a host do not compete for the same cores. Contiguous CPU ids
+        keep a share on one NUMA node with the usual numbering. Nothing is pinned if the
+        launcher already restricted the affinity, or the local rank or size is unknown.
+        """
+        if not hasattr(os, "sched_setaffinity"):
+            logger.warning("CPU affinity is not supported on this platform")
+            return
+        localRank = self.get_local_rank()
+        localSize = getattr(self.comms_world_info, "local_size", -1)
+        cpus = sorted(os.sched_getaffinity(0))
+        if len(cpus) < os.cpu_count():
+            logger.info(f"rank {self.get_global_rank()} already bound to CPUs {cpus}")
+            return
+        if localRank < 0 or localSize <= 0 or len(cpus) < localSize:
+            logger.warning(
+                f"Not pinning, cannot split {len(cpus)} CPUs by local rank "
+                f"{localRank} of {localSize}"
+            )
+            return
+        share = len(cpus) // localSize
+        myCpus = cpus[localRank * share : (localRank + 1) * share]
+        os.sched_setaffinity(0, myCpus)
+        torch.set_num_threads(len(myCpus))
+        logger.info(f"rank {self.get_global_rank()} pinned to CPUs {myCpus}")
+
+    def configure_allocator(self):
+        """
+        Enable expandable segments of the CUDA caching allocator, which grows its
+        segments in place instead of calling cudaMalloc for every new block size, so the
+        small buffers of the NCCL bootstrap and the benchmark tensors fragment less. An
+        allocator configuration given by the user is kept as is.
+        """
+        if not self._dev_str.startswith("cuda") or any(
+            name in os.environ
+            for name in ("PYTORCH_CUDA_ALLOC_CONF", "PYTORCH_ALLOC_CONF")
+        ):
+            return
+        os.environ["PYTORCH_CUDA_ALLOC_CONF"] = "expandable_segments:True"
+        # the allocator reads the variable when CUDA gets initialized, after that it is
+        # only applied through the allocator settings
+        setSettings = getattr(torch.cuda.memory, "_set_allocator_settings", None)
+        if setSettings is not None and torch.cuda.is_initialized():
+            setSettings("expandable_segments:True")
+
     def get_new_stream(self):
         """get/allocate a new stream"""
-        if self.commsParams.device == "cuda":
+        if self._dev_str == "cuda":
             # TODO: optional to use high-priority stream
             return torch.cuda.Stream(device=self.get_device(), priority=0)
         else:
@@ -774,9 +1255,41 @@ class PyTorchDistBackend(backendFunctions):
     # Init functions
     def __init__(self, comms_world_info, commsParams):
         super().__init__()
-        self.use_ext_dist = commsParams.use_ext_dist
         self.comms_world_info = comms_world_info
         self.commsParams = commsParams
+        # TODO: this is a temporary workaround; need to unify the type of commsParams in comms and dlrm
+        # read the params through attributes whether commsParams is a dict or a params holder
+        self._cfg = (
+            SimpleNamespace(**commsParams)
+            if isinstance(commsParams, dict)
+            else commsParams
+        )
+        self.use_ext_dist = self._cfg.use_ext_dist
+        self._dev_str = self._cfg.device
+        # torch device of get_device(), built on first use
+        self._device = None
+        self.quant_cuda_graph = getattr(self._cfg, "quant_cuda_graph", False)
+        self.lazy_pg_init = getattr(self._cfg, "lazy_pg_init", False)
+        self.pin_cpus = getattr(self._cfg, "pin_cpus", False)
+        self.cpu_gloo_pg = getattr(self._cfg, "cpu_gloo_pg", False)
+        # (shape, dtype, bitwidth, group) -> (graph, static input, static output) of graph_quant_all_reduce()
+        self._graph_cache = {}
+        # side stream and last event of dequantize_blocking(), the stream is created on first use
+        self._dequant_stream = None
+        self._dequant_event = torch.cuda.Event() if torch.cuda.is_available() else None
+        self._dequant_pending = False
+        # (length, shape, dtype, device) -> buffer of stacked_reduce_scatter_input()
+        self._rs_scratch = {}
+        # (shape, device) -> float16 buffer of quant_buffer()
+        self._quant_pool = {}
+        # tensor of the init all_reduce in complete_accel_ops(), allocated on first use
+        self._init_op_tensor = None
+        self._init_op_device = None
+        # subgroups of initialize_groups() in creation order, destroyed in reverse order
+        self._created_groups = []
+        # True if initialize_backend() created the default group, only then it is
+        # destroyed with the backend, a group of the caller is kept alive for later runs
+        self._owns_pg = False
         # extra ops supported (Note these are not supported in pytorch_tpu_backend.py)
         self.collectiveFunc[
             "wait"
@@ -791,11 +1304,7 @@ class PyTorchDistBackend(backendFunctions):
             "pt2pt"
         ] = self.noop  # dummy entry to support pt2pt benchmark
 
-        backend = (
-            self.commsParams["backend"]
-            if isinstance(self.commsParams, dict)
-            else self.commsParams.backend
-        )
+        backend = self._cfg.backend
         # Import ucc plugin
         if backend == "ucc":
             # try OSS/setup.py
@@ -823,7 +1332,88 @@ class PyTorchDistBackend(backendFunctions):
         else:
             return dist.new_group(ranks=group_ranks, backend=backend)
 
-    def initialize_backend(self, master_ip, master_port, backend="gloo"):
+    def get_default_pg_backend(self, backend):
+        """
+        Return the backend of the default process group. For NCCL with --cpu-gloo-pg,
+        gloo is added for the CPU tensors, so that small control collectives on host
+        tensors, e.g., object collectives, do not take a round trip through the GPU.
+        The subgroups keep NCCL only, to not pay for a gloo connection mesh per group.
+
+        Args:
+            backend: Backend given by --backend.
+        Returns:
+            str: Backend, or device to backend map, for init_process_group.
+        """
+        # device:backend maps are supported since torch 2.0
+        if (
+            backend == "nccl"
+            and self.cpu_gloo_pg
+            and hasattr(dist.Backend, "default_device_backend_map")
+        ):
+            return "cpu:gloo,cuda:nccl"
+        return backend
+
+    def create_store(self, master_ip, master_port, global_rank, world_size):
+        """
+        Create the rendezvous TCPStore of the default process group on the libuv
+        backend, whose event loop serves the connecting ranks asynchronously instead of
+        one at a time.
+
+        Args:
+            master_ip: Address of the store, hosted by rank 0.
+            master_port: Port of the store.
+            global_rank: Global rank of the local process.
+            world_size: Number of ranks to wait for.
+        Returns:
+            TCPStore: The store, or None to let init_process_group create its own, e.g.,
+            if the torch version does not have libuv, or it is disabled by USE_LIBUV=0.
+            RedisStore if PARAM_USE_REDIS_STORE is set, on the Redis server at master_ip
+            and PARAM_REDIS_PORT (default 6379). Its keys are prefixed by
+            PARAM_REDIS_STORE_PREFIX, or by the TORCHELASTIC_RUN_ID of the run.
+        """
+        if os.environ.get("PARAM_USE_REDIS_STORE"):
+            if not has_redis:
+                raise RuntimeError("PARAM_USE_REDIS_STORE requires the redis package")
+            prefix = os.environ.get("PARAM_REDIS_STORE_PREFIX")
+            if prefix is None:
+                runId = os.environ.get("TORCHELASTIC_RUN_ID")
+                # the keys of an earlier run on the same port are kept until they
+                # expire, they would satisfy the rendezvous of this run
+                if not runId:
+                    raise RuntimeError(
+                        "PARAM_USE_REDIS_STORE requires a unique key prefix per run, "
+                        "set PARAM_REDIS_STORE_PREFIX or TORCHELASTIC_RUN_ID"
+                    )
+                prefix = f"param/{runId}/{master_port}/"
+            return RedisStore(
+                master_ip, int(os.environ.get("PARAM_REDIS_PORT", 6379)), prefix=prefix
+            )
+        if os.environ.get("USE_LIBUV") == "0" or global_rank < 0 or world_size <= 0:
+            return None
+        try:
+            return dist.TCPStore(
+                master_ip,
+                int(master_port),
+                world_size=world_size,
+                is_master=(global_rank == 0),
+                timeout=timedelta(minutes=30),
+                use_libuv=True,
+            )
+        except TypeError:  # use_libuv is not supported in this torch version
+            return None
+
+    def initialize_backend(
+        self, master_ip, master_port, backend="gloo", init_groups=True
+    ):
+        # already initialized by an earlier call, initializing again would re-run the
+        # rendezvous and the group creation on this rank only and hang
+        if dist.is_initialized() and getattr(self, "groups", None):
+            return
+
+        self._owns_pg = not dist.is_initialized()
+        if self.pin_cpus:
+            self.pin_cpu_affinity()
+        self.configure_allocator()
         # Set CUDA device before initializing backend
         # Required for backends that don't do lazy initialization, e.g. UCC
         self.set_device()
@@ -832,46 +1422,112 @@ class PyTorchDistBackend(backendFunctions):
         world_size = self.get_world_size()
 
         # Torch initializaiton
-        # NOTE: MASTER_ADDR and MASTER_PORT should be set already in `comms_utils.py`
-        if world_size > 0:
-            os.environ["WORLD_SIZE"] = str(world_size)
-        if global_rank >= 0:
-            os.environ["RANK"] = str(global_rank)
-
         if has_ext_dist and self.use_ext_dist:
+            # extend_distributed rendezvous through env://, the default group below
+            # gets rank, size and master directly and does not touch the environment
+            # NOTE: MASTER_ADDR and MASTER_PORT are set already in `comms_utils.py`
+            if world_size > 0 and os.environ.get("WORLD_SIZE") != str(world_size):
+                os.environ["WORLD_SIZE"] = str(world_size)
+            if global_rank >= 0 and os.environ.get("RANK") != str(global_rank):
+                os.environ["RANK"] = str(global_rank)
             extend_distributed.init_distributed(
                 rank=global_rank, size=world_size, backend=backend
             )
         else:
             self.use_ext_dist = False
+        # use_ext_dist is final, so get_collective_group() is replaced by a C-level attribute getter
+        # to not pay a python call in every collective
+        self.get_collective_group = attrgetter(
+            "group.my_pg" if self.use_ext_dist else "group"
+        )
+
+        if self.lazy_pg_init:
+            # NCCL already creates its communicators on the first collective, gloo
+            # connects the ranks at group creation unless asked to wait (torch >= 2.6)
+            os.environ.setdefault("TORCH_GLOO_LAZY_INIT", "1")
 
         if not dist.is_initialized():
             # init default process group if not yet initialized or extend_distributed failed or is disabled
-            dist.init_process_group(backend, rank=global_rank, world_size=world_size)
+            store = self.create_store(master_ip, master_port, global_rank, world_size)
+            initKwargs = {"timeout": _INIT_PG_TIMEOUT}
+            if store is None:
+                initKwargs["init_method"] = f"tcp://{master_ip}:{master_port}"
+            else:
+                # init_method and store are exclusive
+                initKwargs["store"] = store
+            if (
+                backend == "nccl"
+                and self._dev_str == "cuda"
+                and _INIT_PG_DEVICE_ID
+                and not self.lazy_pg_init
+            ):
+                # bind the default group to the device: NCCL creates its communicator
+                # at init, and new_group splits the subgroups from it (ncclCommSplit)
+                # instead of running a bootstrap rendezvous per group
+                initKwargs["device_id"] = self.get_device()
+            dist.init_process_group(
+                self.get_default_pg_backend(backend),
+                rank=global_rank,
+                world_size=world_size,
+                **initKwargs,
+            )
 
-        self.groups = {}
+        # callers may defer the groups until commsParams.groupRanks is known, e.g., while the trace is still loading
+        if init_groups:
+            self.initialize_groups(backend)
 
-        # create additional groups
-        for pg_id, group_ranks in self.commsParams.groupRanks.items():
-            if (
-                len(group_ranks) > world_size
-            ):  # this means that --auto-shrink is enabled, only use default pg
-                self.groups.clear()
-                break
+    def initialize_groups(self, backend="gloo"):
+        world_size = self.get_world_size()
+        global_rank = self.get_global_rank()
+        # one default group object for all its pg_ids, with ext_dist every
+        # get_default_group() call wraps the world group anew
+        defaultGroup = self.get_default_group()
+        self.groups = {}
+        self._created_groups = []
+
+        groupRanks = self.commsParams.groupRanks
+        if any(len(group_ranks) > world_size for group_ranks in groupRanks.values()):
+            # this means that --auto-shrink is enabled, only use default pg
+            groupRanks = {}
+
+        # create additional groups, in the same order on all ranks: the traces of
+        # different ranks may list the groups in different orders, so sort them by
+        # their ranks (pg_id breaks the ties of identical rank sets). They are not
+        # created from a thread pool either, new_group updates the unsynchronized c10d
+        # world state.
+        createOrder = sorted(
+            groupRanks.items(),
+            key=lambda item: (len(item[1]), sorted(item[1]), item[0]),
+        )
+        for pg_id, group_ranks in createOrder:
             if (
                 len(group_ranks) == world_size
             ):  # this is the default group, it has already been created
-                pg = self.get_default_group()
+                pg = defaultGroup
             else:
+                # every rank calls new_group, also for the groups it is not a member of:
+                # torch names the groups from a counter that has to advance the same on
+                # all ranks, only the members keep the group
                 pg = self.get_new_pg(group_ranks=group_ranks, backend=backend)
+                if global_rank not in group_ranks:
+                    pg = None
+                else:
+                    self._created_groups.append(pg)
             self.groups[pg_id] = pg
+        # keep the pg_id order of commsParams.groupRanks, e.g., for the round robin
+        self.groups = {pg_id: self.groups[pg_id] for pg_id in groupRanks}
 
         if len(self.groups) == 0:  # if no groups were provided, use default group
-            self.groups[0] = self.get_default_group()
+            self.groups[0] = defaultGroup
 
         self.num_pgs = len(self.groups)
 
-        self.round_robin_group = cycle(list(self.groups.values()))
+        self.round_robin_group = cycle(
+            [pg for pg in self.groups.values() if pg is not None]
+        )
+        # bind get_next_group() to the C-level next of the cycle, it is called for every
+        # collective of a multi-PG run
+        self.get_next_group = self.round_robin_group.__next__
 
     def benchmark_comms(self):
         self.initialize_backend(
@@ -884,6 +1540,36 @@ class PyTorchDistBackend(backendFunctions):
         return
 
     def __del__(self):
-        if dist.is_initialized():
-            dist.destroy_process_group()
+        if getattr(self, "_owns_pg", False) and dist.is_initialized():
+            self.teardown_groups()
         pass
+
+    def close(self):
+        """Destroy the process groups, also if they were created by the caller."""
+        if dist.is_initialized():
+            self.teardown_groups()
+        self._owns_pg = False
+
+    def teardown_groups(self):
+        """
+        Destroy the process groups without letting a hung or crashed rank wedge the
+        others: the ranks meet in a barrier bounded by _TEARDOWN_TIMEOUT, and if it
+        does not complete, the groups are aborted instead of destroyed.
+        """
+        try:
+            dist.barrier(async_op=True).wait(timeout=_TEARDOWN_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Teardown barrier did not complete, aborting groups: {e}")
+            # abort is only available in recent torch versions
+            abort = getattr(dist.distributed_c10d, "_abort_process_group", None)
+            if abort is not None:
+                try:
+                    abort()
+                    return
+                except Exception as abortErr:
+                    logger.warning(f"Aborting the process groups failed: {abortErr}")
+        if not self.use_ext_dist:
+            # ext_dist wraps its groups, they are destroyed with the default group
+            for pg in reversed(getattr(self, "_created_groups", [])):
+                dist.destroy_process_group(pg)
+        dist.destroy_process_group()
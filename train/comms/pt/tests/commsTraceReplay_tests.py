@@ -1,13 +1,23 @@
+import json
+import os
+import tempfile
 import unittest
+from concurrent.futures import Future
 from unittest import mock
 
 import torch
 
 from comms_utils import commsArgs
 
-from param_bench.train.comms.pt.commsTraceReplay import commsTraceReplayBench
+from param_bench.train.comms.pt import commsTraceReplay
+from param_bench.train.comms.pt.commsTraceReplay import (
+    commsTraceReplayBench,
+    extractCommsInfo,
+    parseAllowList,
+)
 from param_bench.train.comms.pt.tests.mocks.backend_mock import MockBackendFunction
 from param_bench.train.comms.pt.tests.test_utils import (
+    comms_world_info_test,
     commsParamsTest,
     createCommsArgs,
     testArgs,
@@ -95,6 +105,52 @@ class TestPrepComms(unittest.TestCase):
         self.assertEqual(1, len(iptensor))
         self.assertEqual(1, len(optensor))
 
+    def test_pooled_tensors(self):
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 1
+        commsParams.device = "cpu"
+        testBench.collectiveArgs.world_size = 1
+        curComm = commsArgs(comms="all_reduce", dtype="Int", inMsgSize=4, outMsgSize=4)
+        (iptensor, optensor) = testBench.prepComms(curComm, commsParams, pooled=True)
+        # all_reduce is in-place
+        self.assertIs(iptensor, optensor)
+        iptensor.fill_(5)
+        testBench.releaseTensors()
+        (newIptensor, _) = testBench.prepComms(curComm, commsParams, pooled=True)
+        # the released buffer is reused and reset for data validation check
+        self.assertIs(iptensor, newIptensor)
+        self.assertEqual([1, 1, 1, 1], newIptensor.tolist())
+        # the buffer is in use until released
+        (otherIptensor, _) = testBench.prepComms(curComm, commsParams, pooled=True)
+        self.assertIsNot(iptensor, otherIptensor)
+
+    def test_cached_tensors(self):
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 0
+        commsParams.device = "cpu"
+        testBench.collectiveArgs.world_size = 2
+        curComm = commsArgs(
+            comms="all_to_allv",
+            dtype="Int",
+            inMsgSize=4,
+            outMsgSize=4,
+            inSplit=[1, 3],
+            outSplit=[2, 2],
+        )
+        (iptensor, optensor) = testBench.prepComms(curComm, commsParams, cacheKey=0)
+        testBench.collectiveArgs.ipTensor_split = None
+        (newIptensor, newOptensor) = testBench.prepComms(
+            curComm, commsParams, cacheKey=0
+        )
+        # the tensors of the first call are reused, the splits are set up again
+        self.assertIs(iptensor, newIptensor)
+        self.assertIs(optensor, newOptensor)
+        self.assertEqual([1, 3], testBench.collectiveArgs.ipTensor_split)
+
 
 class TestWarmUpBench(unittest.TestCase):
     """
@@ -107,7 +163,7 @@ class TestWarmUpBench(unittest.TestCase):
             createCommsArgs(
                 comms="test", inMsgSize=1, outMsgSize=1, markerStack=["test_stack"]
             ),
-            createCommsArgs(comms="all_gather", inMsgSize=2, outmsgSize=2),
+            createCommsArgs(comms="all_gather", inMsgSize=2, outMsgSize=2),
             createCommsArgs(comms="wait", markerStack=["test_stack"]),
         ]
         testBench = commsTraceReplayBench()
@@ -172,17 +228,19 @@ class TestinitTraceStat(unittest.TestCase):
         self.assertEqual(2, sum(testBench.collInMsgSizes["all_gather"]))
         self.assertEqual(2, sum(testBench.collOutMsgSizes["all_gather"]))
         # Dry run records comm blocks. We have two colls in test_stack
-        self.assertEqual(2, len(testBench.comms_blocks["test_stack"]))
+        self.assertEqual(2, len(testBench.comms_blocks["test_stack"]["comms"]))
         # check values of comm_blocks
         self.assertEqual(
-            "test", testBench.comms_blocks["test_stack"][0]["comms"]
+            "test", testBench.comms_blocks["test_stack"]["comms"][0]
         )  # first comm in "test_stack" is test
-        self.assertEqual(1, testBench.comms_blocks["test_stack"][0]["in_msg_size"])
-        self.assertEqual(1, testBench.comms_blocks["test_stack"][0]["out_msg_size"])
+        self.assertEqual(1, testBench.comms_blocks["test_stack"]["in_msg_size"][0])
+        self.assertEqual(1, testBench.comms_blocks["test_stack"]["out_msg_size"][0])
 
         self.assertEqual(
-            "wait", testBench.comms_blocks["test_stack"][1]["comms"]
+            "wait", testBench.comms_blocks["test_stack"]["comms"][1]
         )  # second comm in "test_stack" is wait
+        # wait has no sizes
+        self.assertIsNone(testBench.comms_blocks["test_stack"]["in_msg_size"][1])
 
     def test_not_dry_run(self):
         test_trace = [
@@ -202,7 +260,523 @@ class TestinitTraceStat(unittest.TestCase):
         self.assertEqual(2, sum(testBench.collInMsgSizes["all_gather"]))
         self.assertEqual(2, sum(testBench.collOutMsgSizes["all_gather"]))
         # Not dry run does not record comm blocks.
-        self.assertEqual(0, len(testBench.comms_blocks["test_stack"]))
+        self.assertEqual(0, len(testBench.comms_blocks["test_stack"]["comms"]))
+
+    def test_msg_size_stats(self):
+        test_trace = [
+            createCommsArgs(comms="all_reduce", inMsgSize=4, outMsgSize=4),
+            createCommsArgs(comms="all_gather", inMsgSize=2, outMsgSize=8),
+            createCommsArgs(comms="wait"),
+            createCommsArgs(comms="all_reduce", inMsgSize=1, outMsgSize=1),
+            createCommsArgs(comms="all_reduce", inMsgSize=4, outMsgSize=4),
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.comms_trace = test_trace
+        testBench.initTraceStat()
+        # collectives keep the order they first appear in the trace
+        self.assertEqual(["all_reduce", "all_gather"], list(testBench.collInMsgSizes))
+        # sizes keep the trace order, unique sizes are sorted
+        self.assertEqual([4, 1, 4], testBench.collInMsgSizes["all_reduce"].tolist())
+        self.assertEqual([1, 4], testBench.collInUniMsgSizes["all_reduce"].tolist())
+        self.assertEqual([8], testBench.collOutMsgSizes["all_gather"].tolist())
+        self.assertEqual([8], testBench.collOutUniMsgSizes["all_gather"].tolist())
+        # flat sizes keep the trace order and index the collectives above
+        self.assertEqual([4, 2, 1, 4], testBench.sizes_in.tolist())
+        self.assertEqual([4, 8, 1, 4], testBench.sizes_out.tolist())
+        self.assertEqual([0, 1, 0, 0], testBench.coll_id.tolist())
+        # ops without sizes are still tracked for latency
+        self.assertIn("wait", testBench.collLat)
+
+    def test_dtype(self):
+        test_trace = [
+            createCommsArgs(comms="all_reduce", inMsgSize=4, outMsgSize=4, dtype="Int"),
+            createCommsArgs(comms="wait"),
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.comms_trace = test_trace
+        testBench.initTraceStat()
+        self.assertEqual(torch.int32, test_trace[0].torchDtype)
+        self.assertIsNone(test_trace[1].torchDtype)
+
+    def test_unsupported_dtype(self):
+        test_trace = [
+            createCommsArgs(comms="all_reduce", inMsgSize=4, outMsgSize=4, dtype="Foo")
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.comms_trace = test_trace
+        with self.assertRaises(ValueError):
+            testBench.initTraceStat()
+
+
+class TestInitDispatchPlan(unittest.TestCase):
+    """
+    Test initDispatchPlan to see if only the allowed collectives are going to be replayed.
+    """
+
+    def test_dispatch_plan(self):
+        test_trace = [
+            createCommsArgs(
+                comms="all_reduce", inMsgSize=4, outMsgSize=4, markerStack=["a", "b"]
+            ),
+            createCommsArgs(comms="test", inMsgSize=1, outMsgSize=1),
+            createCommsArgs(comms="wait"),
+            createCommsArgs(comms="all_reduce", inMsgSize=1, outMsgSize=1),
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.comms_trace = test_trace
+        testBench.max_msg_cnt = len(test_trace)
+        testBench.allowList = ["all_reduce", "wait"]
+        testBench.initDispatchPlan(commsParamsTest())
+        # "test" is not in the allow list
+        self.assertEqual([True, False, True, True], testBench.dispatchMask.tolist())
+        # same collectives share the same code
+        self.assertEqual(["all_reduce", "test", "wait"], testBench.dispatchCollNames)
+        self.assertEqual([0, 1, 2, 0], testBench.dispatchCodes.tolist())
+        self.assertEqual(("a", "b"), testBench.dispatchBlocks[0])
+        self.assertEqual((), testBench.dispatchBlocks[2])
+        self.assertEqual("PG: default group", testBench.dispatchGroupDescs[0])
+        # only the entries to be replayed are prepared
+        prepared = testBench._prepared_trace
+        self.assertEqual([0, 2, 3], [p.cnt for p in prepared])
+        self.assertEqual("a b", prepared[0].curBlockStack)
+        self.assertEqual("Unamed/Unknown", prepared[1].curBlockStack)
+        self.assertEqual("a b", prepared[0].baseRecord["marker_stack"])
+        self.assertEqual(4, prepared[0].baseRecord["in_msg_size"])
+        # markers are joined once per distinct marker stack
+        self.assertEqual(
+            {("a", "b"): "a b", (): "Unamed/Unknown"}, testBench._block_stack_cache
+        )
+        self.assertIs(prepared[1].curBlockStack, prepared[2].curBlockStack)
+
+    def test_preallocated_stats(self):
+        test_trace = [
+            createCommsArgs(
+                comms="all_reduce",
+                inMsgSize=4,
+                outMsgSize=4,
+                dtype="Int",
+                markerStack=["a"],
+            ),
+            createCommsArgs(comms="all_reduce", inMsgSize=1, outMsgSize=1, dtype="Int"),
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.collectiveArgs.device = "cpu"
+        testBench.collectiveArgs.world_size = 1
+        testBench.is_blocking = True
+        testBench.comms_trace = test_trace
+        testBench.max_msg_cnt = len(test_trace)
+        testBench.initTraceStat()
+        testBench.allowList = ["all_reduce"]
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 0
+        testBench.initDispatchPlan(commsParams)
+        # sized for num_replays replays of the prepared entries
+        self.assertEqual(2, len(testBench.collLat_np["all_reduce"]))
+        self.assertEqual(1, len(testBench.blockRecordIdx["a"]))
+        # replaying more than planned grows the arrays
+        for _ in range(2):
+            testBench.replayTrace(commsParams)
+        self.assertEqual(4, len(testBench.collLat["all_reduce"]))
+        self.assertEqual(2, testBench._block_idx["a"])
+        # block "a" points to its rows in perfCols
+        self.assertEqual([0, 2], testBench.blockRecordIdx["a"][:2].tolist())
+        self.assertEqual(4, testBench.numPerfRecords)
+
+    def test_trace_with_perf(self):
+        for shrink in (False, True):
+            testBench = commsTraceReplayBench()
+            testBench.backendFuncs = MockBackendFunction()
+            testBench.collectiveArgs.device = "cpu"
+            testBench.collectiveArgs.world_size = 1
+            testBench.is_blocking = True
+            testBench.shrink = shrink
+            testBench.comms_trace = [
+                createCommsArgs(
+                    comms="all_reduce",
+                    inMsgSize=4,
+                    outMsgSize=4,
+                    dtype="Int",
+                    markerStack=["a"],
+                )
+            ]
+            testBench.initTraceStat()
+            testBench.allowList = ["all_reduce"]
+            commsParams = commsParamsTest()
+            commsParams.dcheck = 0
+            testBench.initDispatchPlan(commsParams)
+            testBench.replayTrace(commsParams)
+            testBench.replayTrace(commsParams)
+            records = testBench.getTraceWithPerf()
+            self.assertEqual(2, len(records))
+            # each replayed comm has its own record
+            self.assertIsNot(records[0], records[1])
+            self.assertEqual("a", records[1]["marker_stack"])
+            self.assertEqual(4, records[1]["in_msg_size"])
+            self.assertEqual(
+                testBench.collLat["all_reduce"].tolist(),
+                [r["latency_us"] for r in records],
+            )
+            self.assertIn("global_latency_us", records[0])
+
+
+class TestEventTiming(unittest.TestCase):
+    """
+    Test --event-timing to see if the CUDA event timings replace the host latencies.
+    """
+
+    def setUp(self):
+        self.testBench = commsTraceReplayBench()
+        self.testBench.backendFuncs = MockBackendFunction()
+        self.testBench.collectiveArgs.device = "cpu"
+        self.testBench.collectiveArgs.world_size = 1
+        self.testBench.is_blocking = False
+        self.testBench.event_timing = True
+        self.testBench.comms_trace = [
+            createCommsArgs(comms="all_reduce", inMsgSize=1, outMsgSize=1, dtype="Int")
+        ]
+        self.testBench.initTraceStat()
+        self.testBench.allowList = ["all_reduce"]
+        self.commsParams = commsParamsTest()
+        self.commsParams.dcheck = 0
+
+    def test_no_cuda(self):
+        # falls back to host timers
+        self.testBench.initDispatchPlan(self.commsParams)
+        self.assertEqual([], self.testBench._eventPool)
+
+    def test_event_latency(self):
+        self.testBench.initDispatchPlan(self.commsParams)
+        (start, end) = (mock.MagicMock(), mock.MagicMock())
+        start.elapsed_time.return_value = 2.0  # ms
+        self.testBench._eventPool = [(start, end)]
+        with mock.patch("torch.cuda.synchronize") as synchronize:
+            self.testBench.replayTrace(self.commsParams)
+        synchronize.assert_called_once()
+        start.record.assert_called_once()
+        end.record.assert_called_once()
+        start.elapsed_time.assert_called_once_with(end)
+        self.assertEqual([2000.0], self.testBench.collLat["all_reduce"].tolist())
+        self.assertEqual(2000.0, self.testBench.totalCommsLatency)
+        record = self.testBench.getTraceWithPerf()[0]
+        self.assertEqual(2000.0, record["latency_us"])
+        self.assertEqual(2000.0, record["global_latency_us"])
+
+
+class TestPrepStream(unittest.TestCase):
+    """
+    Test nonblocking replays to see if the tensors of the next entry are prepared on the side stream.
+    """
+
+    def test_prepare_next(self):
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.collectiveArgs.device = "cpu"
+        testBench.collectiveArgs.world_size = 1
+        testBench.is_blocking = False
+        testBench.comms_trace = [
+            createCommsArgs(comms="all_reduce", inMsgSize=1, outMsgSize=1, dtype="Int"),
+            createCommsArgs(comms="all_reduce", inMsgSize=3, outMsgSize=3, dtype="Int"),
+        ]
+        testBench.initTraceStat()
+        testBench.allowList = ["all_reduce"]
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 0
+        testBench.initDispatchPlan(commsParams)
+        # no side stream without CUDA devices
+        self.assertIsNone(testBench._prep_stream)
+
+        prepStream = mock.MagicMock()
+        currentStream = mock.MagicMock()
+        testBench._prep_stream = prepStream
+        testBench.prepComms = mock.MagicMock(wraps=testBench.prepComms)
+        with mock.patch(
+            "torch.cuda.current_stream", return_value=currentStream
+        ), mock.patch("torch.cuda.stream") as cudaStream:
+            testBench.replayTrace(commsParams)
+        # each entry is prepared once, the second one on the side stream
+        self.assertEqual(2, testBench.prepComms.call_count)
+        cudaStream.assert_called_once_with(prepStream)
+        prepStream.wait_stream.assert_called_once_with(currentStream)
+        currentStream.wait_stream.assert_called_once_with(prepStream)
+        self.assertEqual(3, len(testBench.collectiveArgs.opTensor))
+
+
+class TestGetCommGroupInfo(unittest.TestCase):
+    """
+    Test getCommGroupInfo to see if the group info is cached per PG until resetComms().
+    """
+
+    def test_cached_per_pg(self):
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.backendFuncs.get_group_rank = mock.MagicMock(return_value=0)
+        testBench.collectiveArgs.groups = {1: "pg1"}
+        commsParams = commsParamsTest()
+        commsParams.groupRanks = {1: [0, 1]}
+        for _ in range(3):
+            (groupRank, groupDesc) = testBench.getCommGroupInfo(
+                commsArgs(pgId=1), commsParams
+            )
+            testBench.getCommGroupInfo(commsArgs(), commsParams)
+        self.assertEqual(0, groupRank)
+        self.assertEqual("PG: id=1, world_ranks=[0, 1]", groupDesc)
+        # queried once for PG 1 and once for the default group
+        self.assertEqual(2, testBench.backendFuncs.get_group_rank.call_count)
+
+        testBench.resetComms()
+        testBench.getCommGroupInfo(commsArgs(pgId=1), commsParams)
+        self.assertEqual(3, testBench.backendFuncs.get_group_rank.call_count)
+
+
+class TestReplaySingle(unittest.TestCase):
+    """
+    Test replaySingle to see if the comm of the given execution graph node is replayed.
+    """
+
+    def test_replay_single(self):
+        test_trace = [
+            createCommsArgs(
+                comms="all_reduce", inMsgSize=4, outMsgSize=4, dtype="Int", eg_id=7
+            ),
+            createCommsArgs(
+                comms="all_reduce", inMsgSize=2, outMsgSize=2, dtype="Int", eg_id=9
+            ),
+        ]
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.collectiveArgs.device = "cpu"
+        testBench.collectiveArgs.world_size = 1
+        testBench.is_blocking = True
+        testBench.comms_trace = test_trace
+        testBench.initTraceStat()
+        testBench.allowList = ["all_reduce"]
+        self.assertEqual({7: 0, 9: 1}, testBench._eg_id_index)
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 0
+        opTensor = testBench.replaySingle(commsParams, 9, True)
+        self.assertEqual(2, len(opTensor))
+        # no comm for this node
+        self.assertIsNone(testBench.replaySingle(commsParams, 8, True))
+
+
+class TestBenchTime(unittest.TestCase):
+    """
+    Test benchTime to see if ranks are only synced between replays with --inter-replay-barrier,
+    and if the warm-up timings are discarded while its rebalanced sizes are kept.
+    """
+
+    def test_inter_replay_barrier(self):
+        for (interReplayBarrier, numBarriers) in ((False, 2), (True, 4)):
+            testBench = commsTraceReplayBench()
+            testBench.backendFuncs = MockBackendFunction()
+            testBench.backendFuncs.sync_barrier = mock.MagicMock()
+            # blocking collectives also sync, only count the barriers of benchTime
+            testBench.replayTrace = mock.MagicMock()
+            testBench.comms_trace = []
+            testBench.do_warm_up = False
+            testBench.num_replays = 3
+            testBench.inter_replay_barrier = interReplayBarrier
+            testBench.benchTime(commsParamsTest())
+            self.assertEqual(3, testBench.replayTrace.call_count)
+            # one barrier before and one after the replays, plus one between each two replays if enabled
+            self.assertEqual(
+                numBarriers, testBench.backendFuncs.sync_barrier.call_count
+            )
+
+    def test_warm_up_replays(self):
+        for (rebalancePolicy, numReplayTraces) in (("", 3), ("equal", 1)):
+            testBench = commsTraceReplayBench()
+            testBench.backendFuncs = MockBackendFunction()
+            testBench.collectiveArgs.device = "cpu"
+            testBench.collectiveArgs.world_size = 1
+            testBench.comms_trace = [
+                createCommsArgs(
+                    comms="all_reduce", inMsgSize=1, outMsgSize=1, dtype="Int"
+                )
+            ]
+            testBench.initTraceStat()
+            testBench.allowList = ["all_reduce"]
+            testBench.rebalance_policy = rebalancePolicy
+            testBench.warmup_replays = 2
+            testBench.warmUpBench = mock.MagicMock()
+            testBench.replayTrace = mock.MagicMock(wraps=testBench.replayTrace)
+            commsParams = commsParamsTest()
+            commsParams.dcheck = 0
+            testBench.benchTime(commsParams)
+            # with a rebalance policy the splits are rebalanced by warmUpBench()
+            self.assertEqual(
+                1 if rebalancePolicy else 0, testBench.warmUpBench.call_count
+            )
+            self.assertEqual(numReplayTraces, testBench.replayTrace.call_count)
+            # only the timings of the real replay are kept
+            self.assertEqual(1, len(testBench.collLat["all_reduce"]))
+            self.assertEqual(1, testBench.numPerfRecords)
+
+    def test_warm_up_rebalance(self):
+        testBench = commsTraceReplayBench()
+        testBench.backendFuncs = MockBackendFunction()
+        testBench.backendFuncs.world_size = 2
+        testBench.collectiveArgs.device = "cpu"
+        testBench.collectiveArgs.world_size = 2
+        testBench.comms_trace = [
+            createCommsArgs(
+                comms="all_to_allv",
+                inMsgSize=5,
+                outMsgSize=5,
+                inSplit=[2, 3],
+                outSplit=[2, 3],
+                dtype="Int",
+            )
+        ]
+        testBench.initTraceStat()
+        testBench.allowList = ["all_to_allv"]
+        testBench.rebalance_policy = "equal"
+        commsParams = commsParamsTest()
+        commsParams.dcheck = 0
+        testBench.benchTime(commsParams)
+        # the mock all_reduce keeps the local size, so the splits are rebalanced from 5 to 2 elements
+        self.assertEqual(2, testBench.comms_trace[0].inMsgSize)
+        self.assertEqual([1, 1], testBench.comms_trace[0].inSplit)
+        # the records are prepared after the warm-up and report the rebalanced sizes
+        record = testBench.getTraceWithPerf()[0]
+        self.assertEqual(2, record["in_msg_size"])
+        self.assertEqual([1, 1], record["in_split"])
+        self.assertEqual(1, testBench.numPerfRecords)
+
+
+class TestSetBench(unittest.TestCase):
+    """
+    Test setBench to see if the default process group is initialized while the trace is still loading.
+    """
+
+    def test_trace_future(self):
+        testBench = commsTraceReplayBench()
+        commsParams = commsParamsTest()
+        commsParams.nw_stack = "pytorch-dist"
+        commsParams.groupRanks = {}
+        traceFuture = Future()
+        calls = []
+
+        class OverlapBackend(MockBackendFunction):
+            def __init__(self, comms_world_info, commsParams):
+                super().__init__()
+                self.commsParams = commsParams
+
+            def initialize_backend(
+                self, master_ip, master_port, backend="gloo", init_groups=True
+            ):
+                calls.append(("initialize_backend", init_groups, traceFuture.done()))
+                # the trace finishes loading while the default group is set up
+                testBench.comms_trace = [
+                    createCommsArgs(comms="init", pgId=1, groupRanks=[0, 1])
+                ]
+                testBench.max_msg_cnt = 1
+                traceFuture.set_result(None)
+
+            def initialize_groups(self, backend="gloo"):
+                calls.append(("initialize_groups", dict(self.commsParams.groupRanks)))
+
+            def sayHello(self):
+                pass
+
+            def get_num_pgs(self):
+                return 1
+
+        with mock.patch.object(
+            commsTraceReplay.importlib,
+            "import_module",
+            return_value=mock.Mock(PyTorchDistBackend=OverlapBackend),
+        ):
+            testBench.setBench(
+                comms_world_info_test(), commsParams, traceFuture=traceFuture
+            )
+        self.assertEqual(
+            [
+                ("initialize_backend", False, False),
+                ("initialize_groups", {1: [0, 1]}),
+            ],
+            calls,
+        )
+
+
+class TestReadTrace(unittest.TestCase):
+    """
+    Test readTrace to see if a local trace is parsed the same with and without orjson.
+    """
+
+    def test_local_trace(self):
+        in_trace = [
+            {"comms": "all_reduce", "in_msg_size": 4, "out_msg_size": 4, "dtype": "Int"}
+        ]
+        with tempfile.TemporaryDirectory() as tmpDir:
+            traceFile = os.path.join(tmpDir, "rank0.json")
+            with open(traceFile, "w") as f:
+                json.dump(in_trace, f)
+            for hasOrjson in (False, commsTraceReplay.has_orjson):
+                with mock.patch.object(commsTraceReplay, "has_orjson", hasOrjson):
+                    testBench = commsTraceReplayBench()
+                    testBench.trace_file = traceFile
+                    testBench.readTrace(remotePath="")
+                    self.assertEqual(1, len(testBench.comms_trace))
+                    self.assertEqual("all_reduce", testBench.comms_trace[0].comms)
+                    self.assertEqual(4, testBench.comms_trace[0].inMsgSize)
+
+
+class TestWriteCommDetails(unittest.TestCase):
+    """
+    Test writeCommDetails to see if records streamed to a JSON-lines file read back the same with and without orjson.
+    """
+
+    def test_json_lines(self):
+        records = [
+            {"comms": "all_reduce", "in_msg_size": 4, "latency_us": 1.5},
+            {"comms": "wait", "latency_us": 0.25},
+        ]
+        with tempfile.TemporaryDirectory() as tmpDir:
+            for hasOrjson in (False, commsTraceReplay.has_orjson):
+                with mock.patch.object(commsTraceReplay, "has_orjson", hasOrjson):
+                    commsTraceReplay.writeCommDetails(
+                        iter(records), rank=0, folder=tmpDir, jsonLines=True
+                    )
+                with open(os.path.join(tmpDir, "replayedCommsPerf.rank0.jsonl")) as f:
+                    self.assertEqual(records, [json.loads(line) for line in f])
+            commsTraceReplay.writeCommDetails(iter(records), rank=0, folder=tmpDir)
+            with open(os.path.join(tmpDir, "replayedCommsPerf.rank0.json")) as f:
+                self.assertEqual(records, json.load(f))
+
+
+class TestExtractCommsInfo(unittest.TestCase):
+    """
+    Test extractCommsInfo to see if trace entries are converted with missing optional fields left as None.
+    """
+
+    def test_extract(self):
+        in_trace = [
+            {
+                "comms": "all_reduce",
+                "req": 3,
+                "markers": ["a"],
+                "pg_id": 1,
+                "in_msg_size": 4,
+                "out_msg_size": 4,
+                "dtype": "Float",
+            },
+            {"comms": "wait", "req": 3},
+        ]
+        trace = extractCommsInfo(in_trace)
+        self.assertEqual(["all_reduce", "wait"], [c.comms for c in trace])
+        self.assertEqual([0, 1], [c.seqnum for c in trace])
+        self.assertEqual(["a"], trace[0].markerStack)
+        self.assertEqual(1, trace[0].pgId)
+        self.assertEqual(4, trace[0].inMsgSize)
+        self.assertEqual("Float", trace[0].dtype)
+        self.assertIsNone(trace[0].root)
+        self.assertIsNone(trace[0].startTimeNs)
+        self.assertEqual(3, trace[1].req)
+        self.assertIsNone(trace[1].markerStack)
+        self.assertIsNone(trace[1].inMsgSize)
 
 
 class TestInitBench(unittest.TestCase):
@@ -226,6 +800,25 @@ class TestInitBench(unittest.TestCase):
         self.assertEqual(False, args.no_warm_up, not testBench.do_warm_up)
 
 
+class TestParseAllowList(unittest.TestCase):
+    """
+    Test parseAllowList to see if the allowed collectives are matched by name rather than substring.
+    """
+
+    def test_all(self):
+        for allowOps in ("all", "default", "*"):
+            allowList = parseAllowList(allowOps)
+            self.assertIn("all_reduce", allowList)
+            self.assertIn("wait", allowList)
+
+    def test_list(self):
+        allowList = parseAllowList("all_reduce, alltoallv,wait")
+        self.assertEqual(frozenset(["all_reduce", "all_to_allv", "wait"]), allowList)
+        # no substring match
+        self.assertNotIn("all", allowList)
+        self.assertNotIn("reduce", allowList)
+
+
 class TestRebalanceSplit(unittest.TestCase):
     """
     Test rebalance split function based on different policies.
@@ -263,6 +856,22 @@ class TestRebalanceSplit(unittest.TestCase):
         self.assertEqual([4, 4], testComm.inSplit)
         self.assertEqual([4, 4], testComm.outSplit)
 
+    def test_scratch_buffer(self):
+        testBench = commsTraceReplayBench()
+        testBench.collectiveArgs.device = "cpu"
+        testBench.collectiveArgs.world_size = 2
+        testBench.rebalance_policy = "equal"
+        testBench.backendFuncs = MockBackendFunction()
+        testComm = commsArgs(comms="all_to_allv", inMsgSize=8, outMsgSize=8)
+
+        testBench.rebalanceSplit(testComm)
+        scratch = testBench.collectiveArgs.ipTensor
+        testBench.rebalanceSplit(testComm)
+        # the all_reduce buffer is allocated once
+        self.assertIs(scratch, testBench.collectiveArgs.ipTensor)
+        # mock all_reduce keeps the local size, so each rebalance splits it across the 2 ranks again
+        self.assertEqual([1, 1], testComm.inSplit)
+
     def test_unsupported_policy(self):
         testBench = commsTraceReplayBench()
         testBench.rebalance_policy = (
@@ -1,3 +1,4 @@
+import copy
 import os
 import unittest
 
@@ -238,6 +239,61 @@ class TestParamToCommName(unittest.TestCase):
         self.assertEqual("all_to_all", result)
 
 
+class TestCommsArgsCopy(unittest.TestCase):
+    """
+    Test copying commsArgs, used by warm-up so the trace is not modified before real run.
+    """
+
+    def test_copy(self):
+        curComm = comms_utils.commsArgs(
+            comms="all_to_allv", inMsgSize=4, outMsgSize=4, inSplit=[2, 2]
+        )
+        newComm = copy.copy(curComm)
+        self.assertEqual(curComm, newComm)
+        self.assertIsNot(curComm, newComm)
+        # shallow copy shares the split list
+        self.assertIs(curComm.inSplit, newComm.inSplit)
+        # reassigning a field of the copy does not touch the original
+        newComm.inMsgSize = 8
+        self.assertEqual(4, curComm.inMsgSize)
+
+    def test_deepcopy(self):
+        curComm = comms_utils.commsArgs(
+            comms="all_to_allv", inSplit=[2, 2], outSplit=[1, 3], markerStack=["a"]
+        )
+        newComm = copy.deepcopy(curComm)
+        self.assertEqual(curComm, newComm)
+        self.assertIsNot(curComm.inSplit, newComm.inSplit)
+        self.assertIsNot(curComm.outSplit, newComm.outSplit)
+        self.assertIsNot(curComm.markerStack, newComm.markerStack)
+
+    def test_slots(self):
+        curComm = comms_utils.commsArgs(comms="all_reduce", inMsgSize=4)
+        self.assertFalse(hasattr(curComm, "__dict__"))
+        # misspelled fields are not silently added
+        with self.assertRaises(AttributeError):
+            curComm.inmsgSize = 4
+        self.assertEqual(list(comms_utils.commsArgs.__slots__), list(curComm.asDict()))
+        self.assertEqual(4, curComm.asDict()["inMsgSize"])
+        self.assertNotEqual(curComm, comms_utils.commsArgs(comms="all_reduce"))
+
+
+class TestParamProfile(unittest.TestCase):
+    """
+    Test paramProfile to see if the measured interval is added to the timer in both modes.
+    """
+
+    def test_profile(self):
+        for fast in (False, True):
+            timer = comms_utils.paramTimer()
+            with comms_utils.paramProfile(
+                timer=timer, description="test", fast=fast
+            ) as p:
+                torch.ones(3)
+            self.assertGreater(p.intervalNS, 0)
+            self.assertEqual(p.intervalNS, timer.getTimeNS())
+
+
 class TestEnsureTensorFlush(unittest.TestCase):
     """
     Run the function to see if it completes without errors. We want to call item() on last
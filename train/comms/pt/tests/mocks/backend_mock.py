@@ -109,6 +109,9 @@ class MockBackendFunction:  # Mock backend function
     def get_groups(self):
         pass
 
+    def get_group_rank(self, group):
+        return self.global_rank
+
     # Init functions
 
     def initialize_backend(self, master_ip, master_port, backend="gloo"):
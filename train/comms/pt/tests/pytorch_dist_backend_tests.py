@@ -0,0 +1,292 @@
+import os
+import tempfile
+import unittest
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from comms_utils import paramTimer
+
+from param_bench.train.comms.pt import pytorch_dist_backend
+from param_bench.train.comms.pt.pytorch_dist_backend import (
+    _dequantize,
+    _downcast,
+    _fp8_quantize,
+    PyTorchDistBackend,
+    RedisStore,
+)
+from param_bench.train.comms.pt.tests.test_utils import (
+    comms_world_info_test,
+    commsParamsTest,
+)
+
+
+def _toBytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the redis client, with the commands used by RedisStore.
+    """
+
+    def __init__(self, host, port):
+        self.data = {}
+
+    def set(self, key, value, ex=None):
+        self.data[key] = _toBytes(value)
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def delete(self, key):
+        return 1 if self.data.pop(key, None) is not None else 0
+
+    def scan_iter(self, match):
+        return [key for key in self.data if key.startswith(match.rstrip("*"))]
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+    def register_script(self, script):
+        # compare_set is the only script of RedisStore
+        def compareSet(keys, args):
+            (expected, desired) = (_toBytes(args[0]), _toBytes(args[1]))
+            cur = self.data.get(keys[0])
+            if (cur is None and expected == b"") or cur == expected:
+                self.data[keys[0]] = desired
+                return desired
+            return expected if cur is None else cur
+
+        return compareSet
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.ops = []
+
+    def incrby(self, key, amount):
+        self.ops.append((key, amount))
+
+    def expire(self, key, seconds):
+        pass
+
+    def execute(self):
+        (key, amount) = self.ops[0]
+        value = int(self.client.data.get(key, b"0")) + amount
+        self.client.data[key] = _toBytes(value)
+        return [value]
+
+
+def fakeRedisModule():
+    return mock.patch.object(
+        pytorch_dist_backend,
+        "redis",
+        SimpleNamespace(Redis=FakeRedis),
+        create=True,
+    )
+
+
+class TestRedisStore(unittest.TestCase):
+    """
+    Test RedisStore to see if it follows the c10d store contract on a Redis client.
+    """
+
+    def test_set_get(self):
+        with fakeRedisModule():
+            store = RedisStore("localhost", 6379, prefix="run/")
+        store.set("key", "value")
+        self.assertEqual(b"value", store.get("key"))
+        self.assertEqual(b"value", store.client.get("run/key"))
+        self.assertTrue(store.check(["key"]))
+        self.assertFalse(store.check(["key", "missing"]))
+        self.assertEqual(1, store.num_keys())
+        self.assertTrue(store.delete_key("key"))
+        self.assertFalse(store.delete_key("key"))
+        self.assertEqual(0, store.num_keys())
+
+    def test_add(self):
+        with fakeRedisModule():
+            store = RedisStore("localhost", 6379, prefix="run/")
+        self.assertEqual(2, store.add("counter", 2))
+        self.assertEqual(5, store.add("counter", 3))
+        self.assertEqual(b"5", store.get("counter"))
+
+    def test_compare_set(self):
+        with fakeRedisModule():
+            store = RedisStore("localhost", 6379, prefix="run/")
+        # missing key with a non-empty expected value is not set
+        self.assertEqual(b"old", store.compare_set("key", "old", "new"))
+        self.assertFalse(store.check(["key"]))
+        # missing key with an empty expected value is set
+        self.assertEqual(b"first", store.compare_set("key", "", "first"))
+        # mismatch returns the current value
+        self.assertEqual(b"first", store.compare_set("key", "other", "second"))
+        self.assertEqual(b"second", store.compare_set("key", "first", "second"))
+        self.assertEqual(b"second", store.get("key"))
+
+    def test_wait_timeout(self):
+        with fakeRedisModule():
+            store = RedisStore(
+                "localhost", 6379, prefix="run/", timeout=timedelta(seconds=0.01)
+            )
+        with self.assertRaises(RuntimeError):
+            store.wait(["missing"])
+        with self.assertRaises(RuntimeError):
+            store.get("missing")
+        store.set("key", "value")
+        store.wait(["key"], timedelta(seconds=0))
+
+
+class TestCreateStore(unittest.TestCase):
+    """
+    Test create_store to see if the Redis keys are only namespaced by a prefix unique per run.
+    """
+
+    def setUp(self):
+        self.backend = createBackend()
+
+    def createStore(self, env):
+        with fakeRedisModule(), mock.patch.object(
+            pytorch_dist_backend, "has_redis", True
+        ), mock.patch.dict(os.environ, env):
+            # the prefix must not come from the environment of the test run
+            for name in ("PARAM_REDIS_STORE_PREFIX", "TORCHELASTIC_RUN_ID"):
+                if name not in env:
+                    os.environ.pop(name, None)
+            return self.backend.create_store("localhost", "25555", 0, 16)
+
+    def test_no_prefix(self):
+        with self.assertRaises(RuntimeError):
+            self.createStore({"PARAM_USE_REDIS_STORE": "1"})
+
+    def test_prefix(self):
+        store = self.createStore(
+            {"PARAM_USE_REDIS_STORE": "1", "PARAM_REDIS_STORE_PREFIX": "job1/"}
+        )
+        self.assertEqual("job1/", store.prefix)
+        store = self.createStore(
+            {"PARAM_USE_REDIS_STORE": "1", "TORCHELASTIC_RUN_ID": "abc"}
+        )
+        self.assertEqual("param/abc/25555/", store.prefix)
+
+
+class TestGetDefaultPgBackend(unittest.TestCase):
+    """
+    Test get_default_pg_backend to see if gloo is only added to the NCCL default group with --cpu-gloo-pg.
+    """
+
+    def test_default_pg_backend(self):
+        backend = createBackend()
+        self.assertEqual("nccl", backend.get_default_pg_backend("nccl"))
+        self.assertEqual("gloo", backend.get_default_pg_backend("gloo"))
+        backend.cpu_gloo_pg = True
+        self.assertEqual("gloo", backend.get_default_pg_backend("gloo"))
+        if hasattr(pytorch_dist_backend.dist.Backend, "default_device_backend_map"):
+            self.assertEqual(
+                "cpu:gloo,cuda:nccl", backend.get_default_pg_backend("nccl")
+            )
+
+
+def createBackend():
+    commsParams = commsParamsTest()
+    commsParams.use_ext_dist = False
+    commsParams.backend = "gloo"
+    return PyTorchDistBackend(comms_world_info_test(), commsParams)
+
+
+def fp8AllReduceWorker(rank, worldSize, initFile, shape):
+    dist.init_process_group(
+        "gloo", init_method=f"file://{initFile}", rank=rank, world_size=worldSize
+    )
+    try:
+        backend = createBackend()
+        torch.manual_seed(rank)
+        ipTensor = torch.randn(shape)
+        expected = ipTensor.clone()
+        dist.all_reduce(expected)
+        sumAbs = ipTensor.abs()
+        dist.all_reduce(sumAbs)
+        for asyncOp in (False, True):
+            collectiveArgs = SimpleNamespace(
+                group=dist.group.WORLD,
+                asyncOp=asyncOp,
+                waitObj=[],
+                dequant_time=paramTimer(),
+            )
+            retObj = backend._fp8_reduce_collective(
+                collectiveArgs, _fp8_quantize(ipTensor), True, "All_reduce"
+            )
+            if asyncOp:
+                assert collectiveArgs.waitObj == [retObj]
+                result = retObj.wait()
+            else:
+                result = retObj
+            assert result.shape == ipTensor.shape, (asyncOp, result.shape)
+            assert result.dtype == torch.float32
+            # the inputs and the reduced chunks are rounded to FP8 once each
+            assert bool(((result - expected).abs() <= 0.15 * sumAbs).all()), asyncOp
+
+        # the FP8 all_reduce only sums, other ops are reduced on int8
+        ipTensor = ipTensor * 10
+        expected = ipTensor.to(torch.int8)
+        dist.all_reduce(expected, op=dist.ReduceOp.MAX)
+        collectiveArgs = SimpleNamespace(
+            group=dist.group.WORLD, op=dist.ReduceOp.MAX, allreduce_qcomm=8
+        )
+        result = backend._quant_all_reduce(collectiveArgs, ipTensor)
+        assert result.dtype == torch.float32
+        assert torch.equal(expected.to(torch.float32), result), (result, expected)
+    finally:
+        dist.destroy_process_group()
+
+
+@unittest.skipIf(pytorch_dist_backend._FP8_E4M3 is None, "torch has no float8 dtype")
+class TestFp8AllReduce(unittest.TestCase):
+    """
+    Test the FP8 quantization and the two-step FP8 all_reduce to see if the result is within the FP8 error.
+    """
+
+    def test_round_trip(self):
+        ipTensor = torch.randn(1000) * 100
+        quantized = _fp8_quantize(ipTensor)
+        self.assertEqual(pytorch_dist_backend._FP8_E4M3, quantized.dtype)
+        result = _dequantize(quantized)
+        self.assertEqual(torch.float32, result.dtype)
+        # round to nearest with 3 mantissa bits, plus the absolute error of the subnormals
+        bound = ipTensor.abs() / 16 + quantized._param_fp8_scale / 2**10
+        self.assertTrue(bool(((result - ipTensor).abs() <= bound).all()))
+
+    def test_non_sum_op(self):
+        ipTensor = torch.randn(4) * 10
+        self.assertEqual(torch.int8, _downcast(ipTensor, 8, op=dist.ReduceOp.MAX).dtype)
+        self.assertEqual(pytorch_dist_backend._FP8_E4M3, _downcast(ipTensor, 8).dtype)
+
+    def test_zero_tensor(self):
+        quantized = _fp8_quantize(torch.zeros(4))
+        self.assertTrue(bool((_dequantize(quantized) == 0).all()))
+
+    def test_single_rank(self):
+        # the file store of the group removes its file at destroy
+        with tempfile.TemporaryDirectory() as tmpDir:
+            fp8AllReduceWorker(0, 1, os.path.join(tmpDir, "store"), (7,))
+
+    def test_padding(self):
+        # the number of elements is not a multiple of the world size, so the chunks are padded
+        with tempfile.TemporaryDirectory() as tmpDir:
+            mp.spawn(
+                fp8AllReduceWorker,
+                args=(3, os.path.join(tmpDir, "store"), (2, 5)),
+                nprocs=3,
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
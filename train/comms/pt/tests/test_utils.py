@@ -20,6 +20,11 @@ class testArgs:  # default args to run tests with
         self.colls_per_batch = -1
         self.use_timestamp = False
         self.rebalance_policy = ""
+        self.num_replays = 1
+        self.inter_replay_barrier = False
+        self.event_timing = False
+        self.warmup_replays = 1
+        self.legacy_json = False
 
 
 class commsParamsTest:
@@ -34,6 +39,10 @@ class commsParamsTest:
         self.bitwidth = 32
         self.quant_a2a_embedding_dim = 1
         self.quant_threshold = 1
+        self.quant_cuda_graph = False
+        self.lazy_pg_init = False
+        self.pin_cpus = False
+        self.cpu_gloo_pg = False
         self.dcheck = 1
         self.num_pgs = 1
 
@@ -42,6 +51,7 @@ class comms_world_info_test:
     def __init__(self):
         self.global_rank = 0
         self.local_rank = 0
+        self.local_size = 8
         self.world_size = 16
 
         self.master_ip = "localhost"